@@ -0,0 +1,132 @@
+# Retornos, volatilidad, drawdowns y correlaciones sobre la matriz de precios
+
+# Todas las funciones reciben arrays float64 de forma (fechas, monedas), como
+# los de processing.get_price_matrix, y operan por columna sin ciclos por fecha.
+# Los NaN (moneda sin precio en esa fecha) se propagan: un retorno, una ventana
+# o un par de correlacion solo usa filas con datos.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+
+# Periodos por año para anualizar (cripto cotiza todos los dias)
+PERIODS_PER_YEAR = {'1h': 365 * 24, '1d': 365}
+
+
+def returns(prices: np.ndarray, log: bool = False) -> np.ndarray:
+    """
+    Retornos entre filas consecutivas; la primera fila es NaN.
+
+    Parámetros:
+        prices: matriz (fechas, monedas)
+        log: si es True retornos logaritmicos, si no simples
+    """
+    out = np.full(prices.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if log:
+            out[1:] = np.log(prices[1:] / prices[:-1])
+        else:
+            out[1:] = prices[1:] / prices[:-1] - 1
+    return out
+
+
+def rolling_volatility(rets: np.ndarray, window: int = 30, periods_per_year: int = None) -> np.ndarray:
+    """
+    Desviacion estandar movil (ddof=1) de los retornos por columna, con sumas
+    acumuladas: O(fechas x monedas) sin importar la ventana. Una ventana con
+    algun NaN da NaN.
+
+    Parámetros:
+        rets: matriz de retornos (fechas, monedas)
+        window: filas por ventana
+        periods_per_year: si se indica, el resultado se anualiza con sqrt(periodos)
+    """
+    valid = ~np.isnan(rets)
+    # Se centra cada columna para no perder precision en sum(x^2) - sum(x)^2 / n
+    mean = np.where(valid, rets, 0.0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    x = np.where(valid, rets - mean, 0.0)
+
+    def window_sum(a):
+        c = np.cumsum(np.vstack([np.zeros((1, a.shape[1])), a]), axis=0)
+        return c[window:] - c[:-window]
+
+    out = np.full(rets.shape, np.nan)
+    if len(rets) < window or window < 2:
+        return out
+    n = window_sum(valid.astype(float))
+    s1, s2 = window_sum(x), window_sum(x * x)
+    var = np.maximum((s2 - s1 * s1 / window) / (window - 1), 0.0)
+    out[window - 1:] = np.where(n == window, np.sqrt(var), np.nan)
+    if periods_per_year:
+        out *= np.sqrt(periods_per_year)
+    return out
+
+
+def drawdowns(prices: np.ndarray) -> np.ndarray:
+    """
+    Caida desde el maximo historico de cada columna (0 en maximos, negativa debajo).
+    """
+    with np.errstate(invalid='ignore'):
+        peak = np.fmax.accumulate(prices, axis=0)
+        return prices / peak - 1
+
+
+def max_drawdown(prices: np.ndarray) -> np.ndarray:
+    """
+    Peor drawdown de cada columna (NaN si la columna no tiene precios).
+    """
+    dd = drawdowns(prices)
+    out = np.full(dd.shape[1], np.nan)
+    has_data = ~np.isnan(dd).all(axis=0)
+    out[has_data] = np.nanmin(dd[:, has_data], axis=0)
+    return out
+
+
+def correlation_matrix(rets: np.ndarray, min_periods: int = 30) -> np.ndarray:
+    """
+    Correlacion de Pearson entre todas las columnas usando, para cada par, solo
+    las filas donde ambas tienen dato (como DataFrame.corr). Se calcula con
+    productos de matrices en lugar de un ciclo por par.
+
+    Retorna:
+        Matriz (monedas, monedas); NaN en pares con menos de min_periods filas comunes.
+    """
+    valid = (~np.isnan(rets)).astype(float)
+    x = np.where(valid > 0, rets, 0.0)
+    n = valid.T @ valid               # filas comunes por par
+    sx = x.T @ valid                  # suma de x_i donde x_j tiene dato
+    sxx = (x * x).T @ valid
+    sxy = x.T @ x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sxy - sx * sx.T / n
+        var_i = sxx - sx * sx / n
+        var_j = var_i.T
+        corr = cov / np.sqrt(var_i * var_j)
+    corr[n < max(min_periods, 2)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def summary(dates: pd.DatetimeIndex, prices: np.ndarray, coin_ids: list, freq: str = '1d',
+            window: int = 30) -> pd.DataFrame:
+    """
+    Tabla por moneda: retorno total, volatilidad anualizada, volatilidad movil
+    actual y maximo drawdown del periodo.
+    """
+    rets = returns(prices)
+    periods = PERIODS_PER_YEAR[freq]
+    valid = ~np.isnan(prices)
+    cols = np.arange(prices.shape[1])
+    first = prices[valid.argmax(axis=0), cols]
+    last = prices[len(prices) - 1 - valid[::-1].argmax(axis=0), cols] if len(prices) else first
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # columnas sin datos -> NaN
+        volatility = np.nanstd(rets, axis=0, ddof=1) * np.sqrt(periods)
+    rolling = rolling_volatility(rets, window, periods)
+    return pd.DataFrame({
+        'coin_id': coin_ids,
+        'retorno_total': last / first - 1,
+        'volatilidad_anual': volatility,
+        f'volatilidad_{window}': rolling[-1] if len(rolling) else np.nan,
+        'max_drawdown': max_drawdown(prices),
+    })
@@ -1,7 +1,328 @@
+import os
 import time
 import functools
+import threading
 import requests
+import numpy as np
 import pandas as pd
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+from cache import TTLCache, cached
+from http_cache import endpoint_ttl, get_disk_cache
+from payloads import loads, parse_market_chart, parse_ohlc
+
+
+# ===========================
+# Cliente HTTP compartido
+# ===========================
+# La URL base se puede sobreescribir para apuntar a un servidor stub local
+# (pruebas) o a un proxy con cache interno (produccion).
+DEFAULT_BASE_URL = os.environ.get("COINGECKO_BASE_URL", "https://api.coingecko.com/api/v3")
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get("COINGECKO_CONNECT_TIMEOUT", 5))
+DEFAULT_READ_TIMEOUT = float(os.environ.get("COINGECKO_READ_TIMEOUT", 30))
+# Plan publico de CoinGecko: ~30 llamadas/minuto
+DEFAULT_RATE_PER_MINUTE = float(os.environ.get("COINGECKO_RATE_PER_MINUTE", 30))
+DEFAULT_BURST = int(os.environ.get("COINGECKO_BURST", 5))
+# Segundos que se reutiliza una respuesta identica (misma URL y parametros); 0 lo desactiva
+DEFAULT_RESPONSE_TTL = float(os.environ.get("COINGECKO_RESPONSE_TTL", 30))
+# Segundos que se pausa el limitador ante un 429 sin header Retry-After
+DEFAULT_THROTTLE_PAUSE = float(os.environ.get("COINGECKO_THROTTLE_PAUSE", 2))
+
+
+# ===========================
+# Limitador de tasa (token bucket)
+# ===========================
+def _parse_retry_after(value) -> float:
+    """
+    Convierte el header Retry-After (segundos o fecha HTTP) a segundos de espera.
+    Retorna None si no viene o no se puede interpretar.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+    """
+    Token bucket seguro entre hilos para espaciar las llamadas antes de enviarlas.
+
+    Parámetros:
+    - rate: tokens que se recargan por segundo
+    - capacity: tokens maximos acumulables (rafaga permitida)
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._acquired = 0
+        self._waits = 0
+        self._wait_seconds = 0.0
+        self._throttles = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self) -> float:
+        """
+        Bloquea hasta obtener un token. Retorna los segundos esperados.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._blocked_until:
+                    sleep_for = self._blocked_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    self._acquired += 1
+                    if waited:
+                        self._waits += 1
+                        self._wait_seconds += waited
+                    return waited
+                else:
+                    sleep_for = (1 - self._tokens) / self.rate
+            time.sleep(sleep_for)
+            waited += sleep_for
+
+    def penalize(self, seconds: float):
+        """
+        Registra un 429 del servidor: vacia el bucket y bloquea a todos los hilos
+        durante 'seconds' (normalmente el valor de Retry-After).
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = 0.0
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._throttles += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "acquired": self._acquired,
+                "waits": self._waits,
+                "wait_seconds": round(self._wait_seconds, 3),
+                "throttles": self._throttles,
+            }
+
+
+_rate_limiter = TokenBucket(DEFAULT_RATE_PER_MINUTE / 60.0, DEFAULT_BURST)
+
+
+def get_rate_limiter() -> TokenBucket:
+    """
+    Limitador compartido por todas las llamadas a CoinGecko del proceso
+    (todos los hilos y sesiones de Streamlit).
+    """
+    return _rate_limiter
+
+
+class _InflightCall:
+    # Llamada HTTP en curso que comparten los hilos que piden lo mismo
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CoinGeckoClient:
+    """
+    Cliente HTTP con pool de conexiones (keep-alive), timeouts de conexion/lectura,
+    compresion gzip y limitador de tasa para todas las llamadas a CoinGecko.
+
+    Parámetros:
+    - base_url: URL base de la API (por defecto COINGECKO_BASE_URL o la publica)
+    - connect_timeout: segundos maximos para establecer la conexion
+    - read_timeout: segundos maximos esperando datos del servidor
+    - pool_size: numero maximo de conexiones reutilizables por host
+    - rate_limiter: TokenBucket a usar (por defecto el compartido del proceso)
+    - response_ttl: segundos que get_json reutiliza una respuesta identica (0 = nunca)
+    - use_disk_cache: si es True get_json usa el cache persistente de http_cache.py
+      (respuestas frescas sin red; vencidas, revalidadas con ETag / Last-Modified)
+
+    get_json ademas agrupa llamadas identicas en vuelo (single-flight): si varios
+    hilos piden la misma URL con los mismos parametros a la vez, solo uno hace la
+    llamada HTTP y todos reciben el mismo resultado (o la misma excepcion).
+    """
+
+    def __init__(self, base_url: str = None, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT, pool_size: int = 10,
+                 rate_limiter: TokenBucket = None, response_ttl: float = DEFAULT_RESPONSE_TTL,
+                 use_disk_cache: bool = True):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.rate_limiter = rate_limiter or get_rate_limiter()
+        self.response_ttl = response_ttl
+        self.disk_cache = get_disk_cache() if use_disk_cache else None
+        self._responses = TTLCache(max_entries=256)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._coalesced = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate",
+        })
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def get(self, path: str, params: dict = None, timeout=None, headers: dict = None) -> requests.Response:
+        """
+        GET sobre la sesion compartida. Espera turno en el limitador antes de enviar
+        y lanza HTTPError si el status es de error. Un 429 pausa el limitador de
+        este cliente (Retry-After o DEFAULT_THROTTLE_PAUSE); es el unico lugar donde
+        se registra, el decorador de reintentos solo espera y reintenta.
+        """
+        self.rate_limiter.acquire()
+        response = self.session.get(self.url(path), params=params, timeout=timeout or self.timeout,
+                                    headers=headers)
+        if response.status_code == 429:
+            retry_after = _parse_retry_after(response.headers.get("Retry-After"))
+            self.rate_limiter.penalize(DEFAULT_THROTTLE_PAUSE if retry_after is None else retry_after)
+        response.raise_for_status()
+        return response
+
+    def get_json(self, path: str, params: dict = None, timeout=None, parse=loads, ttl: float = None):
+        """
+        GET decodificado, compartido entre llamadas identicas.
+
+        parse recibe el cuerpo en bytes (por defecto JSON con orjson si esta
+        disponible; ver payloads.py para decodificar directo a arrays NumPy).
+        ttl acota los segundos que se reutiliza la respuesta (en memoria y en
+        disco); los llamadores con cache propio pasan el suyo para que el disco
+        nunca sirva datos mas viejos que los que ese cache aceptaria.
+        El resultado puede ser el mismo objeto que reciben otros hilos: no modificarlo.
+        """
+        key = (self.url(path), tuple(sorted((params or {}).items())), parse)
+        hit, value = self._responses.get('http', key)
+        if hit:
+            return value
+
+        with self._inflight_lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InflightCall()
+            else:
+                self._coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._fetch_json(path, params, timeout, parse, ttl)
+            response_ttl = self.response_ttl if ttl is None else min(self.response_ttl, ttl)
+            if response_ttl > 0:
+                self._responses.set('http', key, call.result, response_ttl)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+            call.done.set()
+
+    def _fetch_json(self, path: str, params: dict, timeout, parse=loads, max_ttl: float = None):
+        disk = self.disk_cache
+        if disk is None:
+            return parse(self.get(path, params=params, timeout=timeout).content)
+
+        key = requests.Request('GET', self.url(path), params=sorted((params or {}).items())).prepare().url
+        ttl = endpoint_ttl(path, max_ttl, params)
+        entry = disk.get(key, max_age=ttl)
+        headers = {}
+        if entry is not None:
+            fresh, body, etag, last_modified = entry
+            if fresh:
+                disk.touch(key)
+                disk.record('hit')
+                return parse(body)
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        response = self.get(path, params=params, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            # Sin cambios: se reutiliza el cuerpo guardado y vuelve a quedar fresco
+            disk.touch(key, ttl)
+            disk.record('revalidated')
+            return parse(entry[1])
+
+        data = parse(response.content)
+        disk.put(key, response.content, ttl, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        disk.record('miss')
+        return data
+
+    def stats(self) -> dict:
+        """
+        Contadores del cache de respuestas: hits, misses (llamadas que fueron a la
+        red o esperaron a otra), coalesced (llamadas que esperaron a una identica en
+        vuelo) y, si esta activo, los del cache en disco.
+        """
+        with self._inflight_lock:
+            coalesced = self._coalesced
+        stats = {**self._responses.stats(), "coalesced": coalesced}
+        if self.disk_cache is not None:
+            stats["disk"] = self.disk_cache.stats()
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> CoinGeckoClient:
+    """
+    Devuelve el cliente compartido del proceso (se crea la primera vez).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = CoinGeckoClient()
+    return _client
+
+
+def set_client(client: CoinGeckoClient):
+    """
+    Reemplaza el cliente compartido (ej. para usar otra URL base o timeouts).
+    """
+    global _client
+    with _client_lock:
+        old, _client = _client, client
+    if old is not None and old is not client:
+        old.close()
 
 
 # ===========================
@@ -16,6 +337,10 @@ def retry_on_exception(max_retries=3, delay=2, backoff=2, allowed_statuses=(429,
     - delay: tiempo inicial de espera entre reintentos (en segs)
     - backoff: factor multiplicador para cada reintento (exponencial)
     - allowed_statuses: codigos HTTP que activan reintento
+
+    Los timeouts y errores de conexion del cliente compartido tambien se reintentan.
+    Aqui solo se espera (Retry-After o backoff) antes de reintentar: la pausa de un
+    429 para el resto de hilos ya la aplico CoinGeckoClient.get en su limitador.
     """
     def decorator(func):
         @functools.wraps(func)
@@ -27,15 +352,52 @@ def retry_on_exception(max_retries=3, delay=2, backoff=2, allowed_statuses=(429,
                 except requests.exceptions.HTTPError as e:
                     status = e.response.status_code
                     if status in allowed_statuses:
-                        print(f"[{func.__name__}] Intento {attempt} fallido con status {status}. Reintentando en {wait}s...")
-                        time.sleep(wait)
+                        retry_after = _parse_retry_after(e.response.headers.get("Retry-After"))
+                        pause = wait if retry_after is None else retry_after
+                        print(f"[{func.__name__}] Intento {attempt} fallido con status {status}. Reintentando en {pause}s...")
+                        time.sleep(pause)
                         wait *= backoff
                     else:
                         raise  # Error no esperado, propagar
+                except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                    print(f"[{func.__name__}] Intento {attempt} fallido ({type(e).__name__}). Reintentando en {wait}s...")
+                    time.sleep(wait)
+                    wait *= backoff
             raise Exception(f"[{func.__name__}] Falló tras {max_retries} intentos.")
         return wrapper
     return decorator
 
+# ===========================
+# Granularidad OHLC
+# ===========================
+# El endpoint /ohlc solo acepta estos valores de days
+OHLC_VALID_DAYS = [1, 7, 14, 30, 90, 180, 365]
+# Tamano de vela que devuelve CoinGecko segun days: 1-2 -> 30 min, 3-30 -> 4 h, 31+ -> 4 dias
+OHLC_GRANULARITY_MS = {'30m': 30 * 60 * 1000, '4h': 4 * 3600 * 1000, '4d': 4 * 86400 * 1000}
+
+
+def ohlc_granularity(days: int) -> str:
+    """
+    Granularidad de las velas que devuelve /ohlc para un valor de days.
+    """
+    if days <= 2:
+        return '30m'
+    if days <= 30:
+        return '4h'
+    return '4d'
+
+
+# ===========================
+# TTL del cache de respuestas
+# ===========================
+# Menor que el ciclo del scheduler (15 min) para que cada refresco vea el
+# ultimo punto; vencida la respuesta en disco se revalida con ETag.
+MARKET_CHART_CACHE_TTL = 10 * 60
+# OHLC: velas de 30 min para 1-2 dias, de 4 h para 3-30 dias y de 4 dias para mas.
+def _ohlc_cache_ttl(arguments: dict) -> float:
+    return 5 * 60 if arguments['days'] <= 2 else 30 * 60
+
+
 # ===========================
 # Funcion API con retry
 # ===========================
@@ -51,20 +413,45 @@ def fetch_market_chart(coin_id: str, vs_currency: str = 'usd', days: int = 365,
     - interval: Intervalo de muestreo (por defecto 'daily')
 
     Retorna:
-    - Diccionario con los datos del mercado
+    - Mapeo {'prices' | 'market_caps' | 'total_volumes': (timestamps int64, valores float64)}
+      que convierte cada serie a arrays al pedirla (ver payloads.MarketChart)
     """
-    url = f'https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart'
     params = {
         'vs_currency': vs_currency,
         'days': days,
         'interval': interval
     }
 
-    response = requests.get(url, params=params)
-    response.raise_for_status()  # Si el status no es 200, lanza HTTPError
-    return response.json()
+    # Si el status no es 200, el cliente lanza HTTPError
+    return get_client().get_json(f'coins/{coin_id}/market_chart', params=params, parse=parse_market_chart,
+                                 ttl=MARKET_CHART_CACHE_TTL)
+
+@retry_on_exception(max_retries=4, delay=2.0, backoff=2)
+def fetch_market_chart_range(coin_id: str, from_ms: int, to_ms: int, vs_currency: str = 'usd') -> dict:
+    """
+    Historico de precios entre dos fechas (endpoint /market_chart/range).
+
+    CoinGecko elige la granularidad segun el largo del rango: 5 min hasta 1 dia,
+    por hora hasta 90 dias y diaria para rangos mayores.
+
+    Parametros:
+    - coin_id: ID de la moneda (ej. 'bitcoin')
+    - from_ms, to_ms: limites del rango en epoch ms
+    - vs_currency: Moneda de referencia (por defecto 'usd')
+
+    Retorna:
+    - Mapeo con los datos del mercado (mismo formato que fetch_market_chart)
+    """
+    params = {
+        'vs_currency': vs_currency,
+        'from': int(from_ms) // 1000,  # la API recibe segundos UNIX
+        'to': int(to_ms) // 1000,
+    }
+    return get_client().get_json(f'coins/{coin_id}/market_chart/range', params=params,
+                                 parse=parse_market_chart)
 
 # OHLC
+@cached('api', ttl=_ohlc_cache_ttl)
 @retry_on_exception(max_retries=4, delay=2.0, backoff=2)
 def fetch_ohlc_with_volume(coin_id: str, vs_currency: str = 'usd', days: int = 30) -> pd.DataFrame:
     """
@@ -78,34 +465,35 @@ def fetch_ohlc_with_volume(coin_id: str, vs_currency: str = 'usd', days: int = 3
     Retorna:
     - DataFrame con columnas: date, open, high, low, close, volume
     """
-    import pandas as pd
-    import requests
+    client = get_client()
+    # Mismo TTL que el cache de esta funcion para las dos respuestas (tambien en disco)
+    ttl = _ohlc_cache_ttl({'days': days})
 
-    # --- OHLC data ---
-    url_ohlc = f'https://api.coingecko.com/api/v3/coins/{coin_id}/ohlc'
+    # --- OHLC data (arrays NumPy, sin listas intermedias) ---
     params = {'vs_currency': vs_currency, 'days': days}
-    ohlc_resp = requests.get(url_ohlc, params=params)
-    ohlc_resp.raise_for_status()
-    ohlc_data = ohlc_resp.json()
+    timestamps, ohlc = client.get_json(f'coins/{coin_id}/ohlc', params=params, parse=parse_ohlc, ttl=ttl)
 
-    df_ohlc = pd.DataFrame(ohlc_data, columns=['timestamp', 'open', 'high', 'low', 'close'])
-    df_ohlc['date'] = pd.to_datetime(df_ohlc['timestamp'], unit='ms')
-    df_ohlc.drop(columns='timestamp', inplace=True)
+    # copy: el array es el de la respuesta compartida por el cache del cliente
+    df_ohlc = pd.DataFrame(ohlc, columns=['open', 'high', 'low', 'close'], copy=True)
+    df_ohlc['date'] = timestamps.astype('datetime64[ms]')
 
     # --- Volumen data (viene del endpoint market_chart) ---
-    url_vol = f'https://api.coingecko.com/api/v3/coins/{coin_id}/market_chart'
     params = {'vs_currency': vs_currency, 'days': days, 'interval': 'daily'}
-    vol_resp = requests.get(url_vol, params=params)
-    vol_resp.raise_for_status()
-    vol_data = vol_resp.json()['total_volumes']
-
-    df_vol = pd.DataFrame(vol_data, columns=['timestamp', 'volume'])
-    df_vol['date'] = pd.to_datetime(df_vol['timestamp'], unit='ms')
-    df_vol.drop(columns='timestamp', inplace=True)
+    market_data = client.get_json(f'coins/{coin_id}/market_chart', params=params, parse=parse_market_chart,
+                                  ttl=ttl)
+    vol_timestamps, volumes = market_data['total_volumes']
 
-    # --- Combinar por fecha ---
-    df = pd.merge(df_ohlc, df_vol, on='date', how='inner')
+    # --- Volumen por vela ---
+    # total_volumes es el volumen de 24 h que termina en cada muestra diaria y
+    # las velas (30 min / 4 h / 4 dias) se marcan con su hora de cierre: cada
+    # vela toma la primera muestra en o despues de su cierre (la ultima muestra
+    # es "ahora"). Se conservan todas las velas, no solo las de medianoche.
+    if len(vol_timestamps):
+        idx = np.searchsorted(vol_timestamps, timestamps, side='left')
+        df_ohlc['volume'] = volumes[np.minimum(idx, len(vol_timestamps) - 1)]
+    else:
+        df_ohlc['volume'] = np.nan
 
-    return df
+    return df_ohlc[['open', 'high', 'low', 'close', 'date', 'volume']]
 
 
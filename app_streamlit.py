@@ -1,25 +1,39 @@
 import streamlit as st
 from processing import (
-    get_historical_price_dataframe,
+    get_price_bounds,
+    refresh_prices_for_coins,
     insert_investment,
     get_all_investments,
-    delete_investment,
-    get_investments_by_coin,
-    bulk_insert_investments
+    delete_investments,
+    bulk_insert_investments,
+    get_price_matrix,
+    load_prices,
+    AVAILABLE_COINS
 )
-from plotter import plot_comparison_with_marker
+from plotter import build_price_grid, build_correlation_heatmap, MAX_POINTS_PER_TRACE
+import analytics
+from scheduler import start_price_refresher
 import pandas as pd
 
 
 st.set_page_config(page_title="CryptoAI ",layout="wide")
 st.title("📊 CryptoAI - Visualización & Registro de Inversiones")
 
+
+# Refresco de precios en segundo plano: un solo hilo por proceso del servidor
+@st.cache_resource
+def _price_refresher():
+    return start_price_refresher(coins=AVAILABLE_COINS)
+
+
+_price_refresher()
+
 # ======= PARTE 1: Comparador de criptomonedas =======
 #st.header("🔍 Comparar precios históricos")
 
 
 # Selección de monedas
-available_coins = ["algorand", "solana", "bitcoin", "cardano", "dogecoin", "avalanche-2", "polkadot", "chainlink", "arbitrum", "aave"]
+available_coins = AVAILABLE_COINS
 selected_coins = st.multiselect(
     "Selecciona hasta 4 monedas para comparar",
     options=available_coins,
@@ -30,116 +44,54 @@ if len(selected_coins) < 2:
     st.warning("Selecciona al menos 2 monedas.")
     st.stop()
 
-# Descargar data
-coin_dataframes = {}
-for coin in selected_coins:
-    #coin_dataframes[coin] = get_historical_price_dataframe(coin)
-    try:
-        coin_dataframes[coin] = get_historical_price_dataframe(coin)
-    except Exception as e:
+# Leer data desde SQLite (la mantiene al dia el refresco en segundo plano;
+# solo se descarga, en paralelo, si una moneda aun no tiene datos). El rango
+# del slider sale de MIN/MAX por moneda, sin leer los historicos completos.
+price_bounds = get_price_bounds(selected_coins)
+missing_coins = [coin for coin in selected_coins if coin not in price_bounds]
+if missing_coins:
+    _, coin_errors = refresh_prices_for_coins(missing_coins)
+    for coin, e in coin_errors.items():
         st.error(f"❌ Error al obtener datos de {coin.upper()}: {str(e)}")
-        continue  # sigue con la siguiente moneda
-
-# Crear subgraficas organizadas en 2 columnas
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
-
-cols = 2
-rows = (len(selected_coins) + 1) // 2
-fig = make_subplots(rows=rows, cols=cols, subplot_titles=[coin.capitalize() for coin in selected_coins])
-
-for idx, coin in enumerate(selected_coins):
-    row = (idx // cols) + 1
-    col = (idx % cols) + 1
-    df = coin_dataframes[coin]
-
-    # Línea de precio
-    fig.add_trace(
-        go.Scatter(x=df['date'], y=df['price_usd'], mode='lines', name=coin),
-        row=row, col=col
-    )
+    price_bounds = get_price_bounds(selected_coins)
 
-    # Ultimo punto con texto y color rojo  -  '%Y-%m-%d'
-    # Añadir punto rojo como antes
-    last_row = df.iloc[-1]
-    fig.add_trace(
-        go.Scatter(
-            x=[last_row['date']],
-            y=[last_row['price_usd']],
-            mode='markers',
-            marker=dict(size=8, color='red', symbol='circle'),
-            name=f"{coin} último"
-        ),
-        row=row, col=col
-    )
+# Rango visible y resolucion: al acotar el rango se vuelve a reducir solo esa
+# ventana, asi un rango corto se ve con todos sus puntos y el payload al
+# navegador queda acotado sin importar el largo del historico
+coin_dataframes = {}
+if price_bounds:
+    min_date = min(lo for lo, _ in price_bounds.values()).date()
+    max_date = max(hi for _, hi in price_bounds.values()).date()
+    col_range, col_mode = st.columns([3, 1])
+    date_range = col_range.slider("Rango de fechas", min_value=min_date, max_value=max_date,
+                                  value=(min_date, max_date), format="YYYY-MM-DD")
+    resolution = col_mode.selectbox("Resolución", options=["LTTB", "Min/Max", "Completa"], index=0)
+    start = pd.Timestamp(date_range[0])
+    end = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1) - pd.Timedelta(milliseconds=1)
+    # Rangos largos se leen de los agregados diarios/semanales; rangos cortos, de los puntos crudos
+    coin_dataframes = {
+        coin: window for coin in selected_coins if coin in price_bounds
+        if (window := load_prices(coin, start, end)) is not None
+    }
 
-    # Añadir texto con fondo rojo y letras blancas como anotación
-    fig.add_annotation(
-        x=last_row['date'],
-        y=last_row['price_usd'],
-        text=f"{last_row['date'].strftime('%m-%d')}<br>${last_row['price_usd']:.2f}",
-        showarrow=True,
-        arrowhead=0,
-        ax=30,
-        ay=-30,
-        font=dict(color='white', size=9),
-        align='right',
-        bgcolor='red',
-        bordercolor='red',
-        borderwidth=1,
-        row=row,
-        col=col
+# Crear subgraficas organizadas en 2 columnas
+if coin_dataframes:
+    fig = build_price_grid(
+        coin_dataframes,
+        max_points=None if resolution == "Completa" else MAX_POINTS_PER_TRACE,
+        method="minmax" if resolution == "Min/Max" else "lttb",
     )
-
-    # Inversiones alineadas
-    inv_df = get_investments_by_coin(coin)
-    if not inv_df.empty:
-        merged = pd.merge(inv_df, df, on="date", how="inner")
-        fig.add_trace(
-            go.Scatter(
-                x=merged['date'],
-                y=merged['price_usd'],
-                mode='markers+text',
-                marker=dict(size=10, color='black', symbol='hexagon'),
-                text=[f"${a:.0f}" for a in merged['amount']],
-                textposition="bottom center",
-                name=f"Inversiones en {coin}"
-            ),
-            row=row, col=col
-        )
-
-# Layout
-fig.update_layout(
-    title_text="Comparador múltiple de precios con puntos de inversión",
-    height=600 * rows,
-    width=1200,
-    showlegend=False,
-    hovermode="x unified"  # ← NUEVO: activa spike + tooltip combinado
-)
-
-# Estetica de ejes
-for r in range(1, rows + 1):
-    for c in range(1, cols + 1):
-        #fig.update_xaxes(title_text="Fecha", tickformat="%b\n%Y", dtick="M1", tickangle=-45,
-        #                 tickfont=dict(size=9), row=r, col=c)
-        fig.update_xaxes(
-            title_text="Fecha",
-            tickformat="%b\n%Y",
-            dtick="M1",
-            tickangle=-45,
-            tickfont=dict(size=9),
-            showspikes=True,  # ← NUEVO: activa línea vertical
-            spikemode="across",  # ← NUEVO: línea cruzando subplots
-            spikesnap="cursor",  # ← NUEVO: sigue el cursor
-            spikedash="dot",  # ← NUEVO: línea punteada
-            spikethickness=1,
-            spikecolor="gray",
-            row=r,
-            col=c
-        )
-        fig.update_yaxes(title_text="Precio USD", row=r, col=c)
-
-st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(fig, use_container_width=True)
+
+# Riesgo y correlacion sobre la matriz alineada (una lectura para todas las monedas)
+with st.expander("📐 Retornos, volatilidad y correlación"):
+    dates, prices = get_price_matrix(selected_coins)
+    if len(dates) < 2:
+        st.info("No hay suficiente historico para calcular retornos.")
+    else:
+        st.dataframe(analytics.summary(dates, prices, selected_coins), use_container_width=True)
+        corr = analytics.correlation_matrix(analytics.returns(prices))
+        st.plotly_chart(build_correlation_heatmap(corr, selected_coins), use_container_width=True)
 
 # ======= PARTE 2: Registro de inversion =======
 st.header("📝 Registrar nueva inversión")
@@ -184,7 +136,8 @@ uploaded_file = st.file_uploader("📤 Sube un archivo CSV con columnas: coin_id
 
 if uploaded_file:
     try:
-        df = pd.read_csv(uploaded_file)
+        # Solo se leen unas filas para validar columnas y mostrar la vista previa
+        df = pd.read_csv(uploaded_file, nrows=5)
 
         # Validar columnas requeridas
         expected_cols = {"coin_id", "date", "investor", "amount", "note"}
@@ -195,10 +148,15 @@ if uploaded_file:
             st.dataframe(df.head())
 
             if st.button("🚀 Cargar inversiones"):
-                result = bulk_insert_investments(df)
+                # Carga por bloques: el archivo completo nunca se tiene en memoria
+                uploaded_file.seek(0)
+                result = bulk_insert_investments(pd.read_csv(uploaded_file, chunksize=50_000))
                 st.success(f"✅ Se insertaron {result['insertados']} registros.")
-                if result['errores'] > 0:
-                    st.warning(f"⚠️ Se omitieron {result['errores']} registros ya existentes (por clave duplicada).")
+                if result['duplicados'] > 0:
+                    st.warning(f"⚠️ Se omitieron {result['duplicados']} registros ya existentes (por clave duplicada).")
+                if result['invalidos'] > 0:
+                    st.warning(f"⚠️ Se rechazaron {result['invalidos']} registros inválidos:")
+                    st.dataframe(result['rechazados'], use_container_width=True)
 
     except Exception as e:
         st.error(f"🚨 Error al procesar el archivo: {e}")
@@ -228,12 +186,7 @@ else:
     if not rows_to_delete.empty:
         st.warning(f"{len(rows_to_delete)} inversión(es) seleccionadas para eliminar.")
         if st.button("Eliminar seleccionadas"):
-            for _, row in rows_to_delete.iterrows():
-                delete_investment(
-                    coin_id=row['coin_id'],
-                    date=row['date'],
-                    investor=row['investor']
-                )
-            st.success("✅ Inversiones eliminadas exitosamente.")
+            deleted = delete_investments(rows_to_delete)
+            st.success(f"✅ {deleted} inversión(es) eliminadas exitosamente.")
             #st.experimental_rerun()  # actualiza todo automáticamente
             st.rerun()
\ No newline at end of file
@@ -0,0 +1,45 @@
+# Backfill del historico de precios por ventanas, reanudable
+#
+# Uso:
+#   python backfill.py                                  # historico completo de la watchlist
+#   python backfill.py --coins bitcoin solana --start 2020-01-01
+#   python backfill.py --workers 2 --window-days 365
+#
+# Si se interrumpe (Ctrl+C, 429 persistentes, caida), volver a correr el mismo
+# comando: las ventanas ya guardadas en backfill_windows se omiten.
+
+import argparse
+import sys
+
+from processing import AVAILABLE_COINS, BACKFILL_WINDOW_DAYS, FULL_HISTORY_START, backfill_prices, from_epoch_ms
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="CryptoAI - backfill reanudable de precios historicos")
+    parser.add_argument("--coins", nargs="+", default=AVAILABLE_COINS)
+    parser.add_argument("--start", default=FULL_HISTORY_START, help="fecha inicial (YYYY-MM-DD)")
+    parser.add_argument("--end", default=None, help="fecha final (por defecto hoy)")
+    parser.add_argument("--vs-currency", default="usd")
+    parser.add_argument("--window-days", type=int, default=BACKFILL_WINDOW_DAYS)
+    parser.add_argument("--workers", type=int, default=None, help="ventanas en paralelo por moneda")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for coin in args.coins:
+        def _progress(window, inserted, error, coin=coin):
+            label = from_epoch_ms(window[0]).date()
+            if error is not None:
+                print(f"❌ {coin} {label}: {error}", file=sys.stderr)
+            else:
+                print(f"{coin} {label}: {inserted} insertados")
+
+        result = backfill_prices(coin, args.start, args.end, args.vs_currency, args.window_days,
+                                 args.workers, on_window=_progress)
+        print(f"[{coin}] {result['completadas']} ventanas nuevas, {result['omitidas']} ya guardadas, "
+              f"{result['fallidas']} fallidas, {result['insertados']} precios insertados")
+        failed = failed or result['fallidas'] > 0
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,61 @@
+# Benchmark del motor de indicadores: costo por vela de update() vs recalculo completo
+#
+#   python benchmarks/bench_indicators.py
+#
+# update() debe mantenerse plano al crecer el historico; compute_indicators()
+# (recalcular todo al llegar una vela) crece de forma lineal.
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indicators import IndicatorEngine, compute_indicators  # noqa: E402
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+NEW_BARS = 200
+
+
+def synthetic_ohlcv(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    return pd.DataFrame({
+        'date': pd.date_range('2000-01-01', periods=n, freq='30min'),
+        'open': close + rng.normal(0, 0.3, n),
+        'high': close + rng.random(n),
+        'low': close - rng.random(n),
+        'close': close,
+        'volume': rng.random(n) * 1_000,
+    })
+
+
+def main():
+    print(f"{'historico':>10} | {'fit (s)':>8} | {'update/vela (us)':>16} | {'recalculo completo (ms)':>23}")
+    print("-" * 68)
+    for n in SIZES:
+        df = synthetic_ohlcv(n + NEW_BARS)
+        history, new_bars = df.iloc[:n], df.iloc[n:]
+
+        engine = IndicatorEngine()
+        start = time.perf_counter()
+        engine.fit(history)
+        fit_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(NEW_BARS):
+            engine.update(new_bars.iloc[i:i + 1])
+        update_us = (time.perf_counter() - start) / NEW_BARS * 1e6
+
+        start = time.perf_counter()
+        compute_indicators(df.iloc[:n + 1])
+        full_ms = (time.perf_counter() - start) * 1e3
+
+        print(f"{n:>10,} | {fit_s:>8.3f} | {update_us:>16.1f} | {full_ms:>23.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# Benchmark de decodificacion de respuestas de /market_chart
+#
+#   python benchmarks/bench_json.py
+#
+# Compara, sobre cuerpos sinteticos de 1 a 5 años de precios por hora:
+#   - anterior: json.loads + DataFrame de listas + pd.to_datetime(unit='ms')
+#   - orjson:   payloads.loads (orjson) + rows_to_arrays + process_price_data
+#   - payloads: parse_market_chart (lectura directa de los bytes, solo 'prices') + process_price_data
+#   - 3 series: payloads convirtiendo tambien market_caps y total_volumes
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from payloads import loads, orjson, parse_market_chart, rows_to_arrays  # noqa: E402
+from processing import process_price_data  # noqa: E402
+
+YEARS = [1, 2, 5]
+REPEAT = 5
+
+
+def synthetic_body(hours: int, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    timestamps = 1_600_000_000_000 + np.arange(hours, dtype=np.int64) * 3_600_000
+    series = {
+        'prices': 30_000 + np.cumsum(rng.normal(0, 50, hours)),
+        'market_caps': rng.random(hours) * 1e12,
+        'total_volumes': rng.random(hours) * 1e10,
+    }
+    data = {k: [[int(t), float(v)] for t, v in zip(timestamps, values)] for k, values in series.items()}
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def legacy(body: bytes) -> pd.DataFrame:
+    # Camino anterior (response.json() + DataFrame + to_datetime)
+    df = pd.DataFrame(json.loads(body)['prices'], columns=['timestamp', 'price_usd'])
+    df['date'] = pd.to_datetime(df['timestamp'], unit='ms')
+    return df[['date', 'price_usd']]
+
+
+def decoded(body: bytes) -> pd.DataFrame:
+    data = loads(body)
+    return process_price_data({'prices': rows_to_arrays(data['prices'])})
+
+
+def direct(body: bytes) -> pd.DataFrame:
+    return process_price_data(parse_market_chart(body))
+
+
+def direct_all(body: bytes) -> tuple:
+    chart = parse_market_chart(body)
+    return tuple(chart[key] for key in ('prices', 'market_caps', 'total_volumes'))
+
+
+def timed(func, body: bytes) -> float:
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(body)
+        best = min(best, time.perf_counter() - start)
+    return best * 1e3
+
+
+def main():
+    print(f"orjson: {'si' if orjson is not None else 'no (json de la libreria estandar)'}")
+    print(f"{'años':>4} | {'MB':>5} | {'anterior (ms)':>13} | {'orjson (ms)':>11} | "
+          f"{'payloads (ms)':>13} | {'3 series (ms)':>13} | {'mejora':>6}")
+    print("-" * 86)
+    for years in YEARS:
+        body = synthetic_body(years * 365 * 24)
+        pd.testing.assert_frame_equal(legacy(body), direct(body))
+        old_ms, loads_ms, direct_ms = timed(legacy, body), timed(decoded, body), timed(direct, body)
+        all_ms = timed(direct_all, body)
+        print(f"{years:>4} | {len(body) / 1e6:>5.1f} | {old_ms:>13.1f} | {loads_ms:>11.1f} | "
+              f"{direct_ms:>13.1f} | {all_ms:>13.1f} | {old_ms / direct_ms:>5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Cache en memoria con TTL e invalidacion explicita
+
+import copy
+import functools
+import inspect
+import threading
+import time
+
+import pandas as pd
+
+
+# El cache vive a nivel de modulo: en Streamlit lo comparten todas las sesiones y
+# reruns del mismo proceso del servidor (a diferencia de st.cache_data, permite
+# invalidar solo las claves afectadas por una escritura, p.ej. una sola moneda).
+MAX_ENTRIES = 512
+
+
+def _copy(value):
+    # Los llamadores modifican los DataFrames (ej. agregar columnas), asi que
+    # nunca se entrega el objeto guardado en el cache.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(v) for v in value)
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class TTLCache:
+    """
+    Cache thread-safe de (namespace, clave) -> valor con expiracion por entrada.
+
+    Cada entrada puede llevar una etiqueta (ej. el coin_id) para invalidar solo
+    las claves de esa etiqueta; las entradas sin etiqueta dependen de todo el
+    namespace y se invalidan con cualquier escritura en el.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, namespace: str, key) -> tuple:
+        with self._lock:
+            entry = self._data.get((namespace, key))
+            if entry is not None and entry[0] > time.monotonic():
+                self._hits += 1
+                return True, entry[2]
+            if entry is not None:
+                del self._data[(namespace, key)]
+            self._misses += 1
+            return False, None
+
+    def set(self, namespace: str, key, value, ttl: float, tag=None):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+            self._data[(namespace, key)] = (time.monotonic() + ttl, tag, value)
+            if len(self._data) > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for k in [k for k, (expires, _, _) in self._data.items() if expires <= now]:
+            del self._data[k]
+        # Si sigue lleno, se descartan las entradas mas antiguas (orden de insercion)
+        while len(self._data) > self.max_entries:
+            del self._data[next(iter(self._data))]
+
+    def invalidate(self, namespace: str = None, tag=None) -> int:
+        """
+        Elimina entradas. Sin namespace vacia todo el cache; con tag solo elimina
+        las entradas de esa etiqueta y las que no tienen etiqueta.
+        """
+        with self._lock:
+            doomed = [
+                k for k, (_, entry_tag, _) in self._data.items()
+                if (namespace is None or k[0] == namespace)
+                and (tag is None or entry_tag is None or entry_tag == tag)
+            ]
+            for k in doomed:
+                del self._data[k]
+            return len(doomed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._data), "hits": self._hits, "misses": self._misses}
+
+
+_cache = TTLCache()
+
+
+def get_cache() -> TTLCache:
+    return _cache
+
+
+def invalidate(namespace: str = None, tag=None) -> int:
+    return _cache.invalidate(namespace, tag)
+
+
+def cached(namespace: str, ttl, tag=None):
+    """
+    Decorador que guarda el resultado de la funcion en el cache compartido.
+
+    Parámetros:
+    - namespace: grupo de claves que se invalida junto (ej. 'prices')
+    - ttl: segundos de vida, o funcion(argumentos) -> segundos
+    - tag: funcion(argumentos) -> etiqueta para invalidacion selectiva
+
+    'argumentos' es el diccionario {nombre: valor} de la llamada, con defaults.
+    Las llamadas con argumentos no hasheables (ej. DataFrames) no se cachean.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            key = (func.__qualname__, tuple(arguments.items()))
+            try:
+                hit, value = _cache.get(namespace, key)
+            except TypeError:
+                return func(*args, **kwargs)
+            if hit:
+                return _copy(value)
+
+            value = func(*args, **kwargs)
+            seconds = ttl(arguments) if callable(ttl) else ttl
+            _cache.set(namespace, key, _copy(value), seconds, tag(arguments) if tag else None)
+            return value
+
+        wrapper.cache_clear = lambda: _cache.invalidate(namespace)
+        return wrapper
+    return decorator
@@ -0,0 +1,230 @@
+# Copia columnar (Arrow IPC) del historico de precios, sincronizada con SQLite
+
+# Es opcional: requiere pyarrow y se activa con CRYPTOAI_COLUMNAR=1. SQLite sigue
+# siendo la fuente de verdad; cada moneda tiene un archivo Arrow IPC ordenado por
+# fecha que se lee con memory-map (sin copiar ni parsear) para estudios largos
+# de varias monedas.
+#
+#   data/columnar/prices/<coin_id>.arrow   -> date (timestamp ms), price_usd (float64)
+#
+# Con la copia activa, processing._read_prices lee de aqui cuando el archivo
+# coincide con SQLite (mismas fechas minima y maxima). Desde la terminal:
+#
+#   python columnar.py                 # reconstruye los archivos desde SQLite
+#   python columnar.py --parquet       # y exporta el dataset Parquet
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db import get_connection, to_epoch_ms
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # dependencia opcional
+    pa = None
+    ds = None
+
+COLUMNAR_DIR = os.path.join("data", "columnar")
+PRICES_DIR = os.path.join(COLUMNAR_DIR, "prices")
+PRICE_COLUMNS = ['date', 'price_usd']
+
+# Un lock por moneda: las ventanas de un backfill escriben la misma moneda en paralelo
+_coin_locks = {}
+_coin_locks_guard = threading.Lock()
+
+
+def _coin_lock(coin_id: str) -> threading.Lock:
+    with _coin_locks_guard:
+        return _coin_locks.setdefault(coin_id.lower(), threading.Lock())
+
+
+def is_available() -> bool:
+    return pa is not None
+
+
+def is_enabled() -> bool:
+    """
+    True si la copia columnar esta activa (pyarrow instalado y CRYPTOAI_COLUMNAR=1).
+    """
+    return is_available() and os.environ.get("CRYPTOAI_COLUMNAR", "0") == "1"
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("El almacenamiento columnar requiere pyarrow: pip install pyarrow")
+
+
+def _schema():
+    return pa.schema([('date', pa.timestamp('ms')), ('price_usd', pa.float64())])
+
+
+def _coin_path(coin_id: str) -> str:
+    return os.path.join(PRICES_DIR, f"{coin_id.lower()}.arrow")
+
+
+def _read_table(coin_id: str):
+    path = _coin_path(coin_id)
+    if not os.path.exists(path):
+        return None
+    # memory_map: las columnas apuntan al archivo mapeado, no se copian a memoria
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def _sqlite_table(coin_id: str, since_ms: int = None):
+    query = "SELECT date, price_usd FROM prices WHERE coin_id = ? AND date >= ? ORDER BY date"
+    rows = get_connection().execute(query, (coin_id.lower(), since_ms or 0)).fetchall()
+    dates = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+    prices = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+    return pa.table([pa.array(dates).cast(pa.timestamp('ms')), pa.array(prices)], schema=_schema())
+
+
+def sync_coin(coin_id: str, since_ms: int = None) -> int:
+    """
+    Sincroniza el archivo Arrow de la moneda con SQLite.
+
+    Parámetros:
+        coin_id: ID de la criptomoneda
+        since_ms: primera fecha (epoch ms) modificada en SQLite; las filas anteriores
+            se conservan del archivo y desde ahi se releen de SQLite.
+            None reconstruye el archivo completo.
+
+    Retorna:
+        Numero de filas del archivo resultante.
+    """
+    _require_pyarrow()
+    os.makedirs(PRICES_DIR, exist_ok=True)
+    # Lectura, union y reemplazo bajo el lock de la moneda: dos escritores
+    # concurrentes perderian filas del otro
+    with _coin_lock(coin_id):
+        return _sync_coin_locked(coin_id, since_ms)
+
+
+def _sync_coin_locked(coin_id: str, since_ms: int = None) -> int:
+    current = _read_table(coin_id) if since_ms is not None else None
+    fresh = _sqlite_table(coin_id, since_ms if current is not None else None)
+    if current is not None:
+        keep = int(np.searchsorted(_date_values(current), since_ms, side='left'))
+        table = pa.concat_tables([current.slice(0, keep), fresh])
+    else:
+        table = fresh
+    # Un solo record batch: al leer, cada columna es un unico buffer contiguo
+    table = table.combine_chunks()
+
+    # Archivo temporal con nombre unico en el mismo directorio (os.replace atomico)
+    with tempfile.NamedTemporaryFile(dir=PRICES_DIR, prefix=f"{coin_id.lower()}.", suffix=".tmp",
+                                     delete=False) as tmp:
+        tmp_path = tmp.name
+    try:
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, _coin_path(coin_id))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return table.num_rows
+
+
+def sync_all(coin_ids: list = None) -> dict:
+    """
+    Reconstruye los archivos de las monedas indicadas (por defecto todas las de SQLite).
+    """
+    _require_pyarrow()
+    if coin_ids is None:
+        coin_ids = [r[0] for r in get_connection().execute("SELECT DISTINCT coin_id FROM prices")]
+    return {coin: sync_coin(coin) for coin in coin_ids}
+
+
+def _date_values(table) -> np.ndarray:
+    # Vista int64 (epoch ms) de la columna date; sin copia si hay un solo chunk
+    return table.column('date').combine_chunks().view(pa.int64()).to_numpy()
+
+
+def file_bounds(coin_id: str):
+    """
+    (primera, ultima) fecha en epoch ms del archivo de la moneda, o None si no
+    hay archivo o esta vacio.
+    """
+    _require_pyarrow()
+    table = _read_table(coin_id)
+    if table is None or table.num_rows == 0:
+        return None
+    dates = _date_values(table)
+    return int(dates[0]), int(dates[-1])
+
+
+def load_prices_columnar(coin_id: str, start=None, end=None, columns: list = None) -> pd.DataFrame:
+    """
+    Lee el historico de una moneda desde su archivo Arrow con memory-map.
+
+    El rango [start, end] se resuelve con busqueda binaria sobre la columna date
+    (el archivo esta ordenado) y solo el tramo y las columnas pedidas se
+    convierten a pandas.
+
+    Parámetros:
+        coin_id: ID de la criptomoneda
+        start, end: limites de fecha inclusivos (str, datetime o Timestamp), opcionales
+        columns: subconjunto de ['date', 'price_usd'] (por defecto ambas)
+
+    Retorna:
+        DataFrame con columnas date (datetime), price_usd (float), o None si no hay archivo.
+    """
+    _require_pyarrow()
+    table = _read_table(coin_id)
+    if table is None:
+        return None
+
+    if start is not None or end is not None:
+        dates = _date_values(table)
+        lo = 0 if start is None else int(np.searchsorted(dates, to_epoch_ms(start), side='left'))
+        hi = len(dates) if end is None else int(np.searchsorted(dates, to_epoch_ms(end), side='right'))
+        table = table.slice(lo, max(hi - lo, 0))
+
+    table = table.select(columns or PRICE_COLUMNS)
+    return table.to_pandas()
+
+
+def export_parquet(dest: str = os.path.join(COLUMNAR_DIR, "parquet"), coin_ids: list = None) -> str:
+    """
+    Exporta los archivos Arrow a un dataset Parquet particionado por coin_id
+    (formato hive: dest/coin_id=<coin>/...), para herramientas externas.
+    """
+    _require_pyarrow()
+    if coin_ids is None:
+        coin_ids = [name[:-len(".arrow")] for name in sorted(os.listdir(PRICES_DIR)) if name.endswith(".arrow")]
+    tables = []
+    for coin in coin_ids:
+        table = _read_table(coin)
+        if table is not None:
+            tables.append(table.append_column('coin_id', pa.array([coin] * table.num_rows, pa.string())))
+    if tables:
+        ds.write_dataset(pa.concat_tables(tables), dest, format="parquet",
+                         partitioning=["coin_id"], partitioning_flavor="hive",
+                         existing_data_behavior="delete_matching")
+    return dest
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="CryptoAI - copia columnar (Arrow / Parquet) de los precios")
+    parser.add_argument("--coins", nargs="+", default=None, help="monedas (por defecto todas las de SQLite)")
+    parser.add_argument("--parquet", action="store_true", help="exportar tambien el dataset Parquet")
+    args = parser.parse_args(argv)
+    _require_pyarrow()
+    for coin, rows in sync_all(args.coins).items():
+        print(f"{coin}: {rows} filas")
+    if args.parquet:
+        print(f"Parquet: {export_parquet(coin_ids=args.coins)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
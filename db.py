@@ -0,0 +1,125 @@
+# Gestion de conexiones SQLite compartida por todo el proyecto
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+DB_PATH = "data/crypto.db"
+
+# Pragmas aplicados a cada conexion nueva
+BUSY_TIMEOUT_S = 30
+MMAP_SIZE = 256 * 1024 * 1024      # 256 MB de mmap para lecturas
+CACHE_SIZE_KB = 64 * 1024          # 64 MB de page cache por conexion
+
+_local = threading.local()
+
+
+def _open_connection(path: str) -> sqlite3.Connection:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S)
+    # WAL: los lectores no bloquean al escritor (varias sesiones de Streamlit)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_connection(path: str = None) -> sqlite3.Connection:
+    """
+    Devuelve la conexion persistente del hilo actual para la base indicada.
+
+    Cada hilo (sesion de Streamlit, worker de un pool) reutiliza su propia
+    conexion en lugar de abrir y cerrar una por consulta.
+
+    Parámetros:
+        path: ruta de la base (por defecto DB_PATH)
+    """
+    path = path or DB_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = connections[path] = _open_connection(path)
+    return conn
+
+
+def close_connection(path: str = None):
+    """
+    Cierra la conexion del hilo actual (si existe).
+    """
+    path = path or DB_PATH
+    connections = getattr(_local, "connections", {})
+    conn = connections.pop(path, None)
+    if conn is not None:
+        conn.close()
+
+
+@contextmanager
+def transaction(path: str = None, immediate: bool = True):
+    """
+    Context manager de transaccion: confirma al salir y revierte si hay excepcion.
+
+    Con immediate=True toma el lock de escritura al inicio (BEGIN IMMEDIATE), lo
+    que evita errores "database is locked" al promover una lectura a escritura.
+    Las transacciones anidadas se integran en la externa.
+
+    Uso:
+        with transaction() as conn:
+            conn.execute("INSERT ...")
+    """
+    conn = get_connection(path)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
+
+
+# ===========================
+# Codificacion de fechas
+# ===========================
+# Las fechas se guardan como INTEGER en milisegundos epoch (UTC). Las fechas sin
+# zona horaria se interpretan como UTC, igual que los timestamps de CoinGecko.
+def to_epoch_ms(value) -> int:
+    """
+    Convierte una fecha (str, date, datetime, Timestamp o epoch ms) a epoch ms.
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return int(ts.value // 1_000_000)
+
+
+def series_to_epoch_ms(values) -> pd.Series:
+    """
+    Version vectorizada de to_epoch_ms. Las fechas invalidas quedan como <NA>.
+    """
+    dates = pd.to_datetime(pd.Series(values), errors="coerce", format="mixed")
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_convert("UTC").dt.tz_localize(None)
+    ms = dates.astype("datetime64[ms]").astype("int64")
+    return ms.where(dates.notna()).astype("Int64")
+
+
+def from_epoch_ms(values) -> pd.Series:
+    """
+    Convierte una columna de epoch ms (como viene de SQLite) a datetime64.
+    """
+    return pd.to_datetime(values, unit="ms")
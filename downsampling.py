@@ -0,0 +1,104 @@
+# Reduccion de puntos de series largas antes de mandarlas al navegador
+
+# Las graficas no pueden mostrar mas puntos que pixeles de ancho: con unos
+# ~1000 puntos por serie la linea se ve igual y el payload queda acotado sin
+# importar cuanto historico haya en SQLite.
+#
+#   - lttb: Largest-Triangle-Three-Buckets, conserva la forma visual (picos y valles)
+#   - minmax: minimo y maximo de cada intervalo, conserva los extremos exactos
+#
+# Ambas retornan indices (ordenados) de las filas a conservar, incluyendo
+# siempre la primera y la ultima.
+
+import numpy as np
+import pandas as pd
+
+METHODS = ('lttb', 'minmax')
+
+
+def _as_float(x) -> np.ndarray:
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ms]').astype(np.int64).astype(float)
+    return x.astype(float)
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    """
+    Indices elegidos por LTTB: en cada intervalo se toma el punto que forma el
+    triangulo de mayor area con el punto elegido en el intervalo anterior y el
+    promedio del siguiente. El ciclo es por intervalo (n_out), no por punto.
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x, y = _as_float(x), np.asarray(y, dtype=float)
+
+    # n_out - 2 intervalos entre el primer y el ultimo punto
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    # Promedio de cada intervalo (el "siguiente" del anterior); el ultimo punto cierra
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1)
+    counts = np.diff(edges)
+    avg_x = np.append(sums_x / counts, x[-1])
+    avg_y = np.append(sums_y / counts, y[-1])
+
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Area (x2) del triangulo (a, punto, promedio del siguiente intervalo)
+        area = np.abs(
+            (x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a])
+            - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a])
+        )
+        a = lo + int(area.argmax())
+        out[i + 1] = a
+    return out
+
+
+def minmax_indices(y, n_out: int) -> np.ndarray:
+    """
+    Indices del minimo y maximo de cada uno de n_out / 2 intervalos, vectorizado
+    con un reshape (los puntos que sobran al final forman su propio intervalo).
+    """
+    n = len(y)
+    if n_out >= n or n_out < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype=float)
+    bins = (n_out - 2) // 2
+    size = -(-(n - 2) // bins)  # techo
+    inner = y[1:n - 1]
+    pad = bins * size - len(inner)
+    padded_lo = np.append(inner, np.full(pad, np.inf)).reshape(bins, size)
+    padded_hi = np.append(inner, np.full(pad, -np.inf)).reshape(bins, size)
+    offsets = 1 + np.arange(bins) * size
+    idx = np.concatenate([offsets + padded_lo.argmin(axis=1), offsets + padded_hi.argmax(axis=1)])
+    idx = idx[idx < n - 1]
+    return np.unique(np.concatenate([[0, n - 1], idx]))
+
+
+def downsample(df: pd.DataFrame, n_out: int, x: str = 'date', y: str = 'price_usd',
+               method: str = 'lttb') -> pd.DataFrame:
+    """
+    Filas de df (ordenado por x) reducidas a ~n_out puntos.
+
+    Parámetros:
+        df: DataFrame con las columnas x, y
+        n_out: puntos objetivo (aprox. el ancho en pixeles de la grafica)
+        method: 'lttb' o 'minmax'
+
+    Retorna:
+        El mismo df si ya tiene n_out puntos o menos; si no, el subconjunto de filas.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Metodo no valido: {method}. Usa uno de {METHODS}")
+    df = df.dropna(subset=[y])
+    if len(df) <= n_out:
+        return df
+    if method == 'lttb':
+        idx = lttb_indices(df[x].to_numpy(), df[y].to_numpy(), n_out)
+    else:
+        idx = minmax_indices(df[y].to_numpy(), n_out)
+    return df.iloc[idx]
@@ -0,0 +1,181 @@
+# Cache persistente de respuestas HTTP de CoinGecko (sobrevive reinicios)
+
+# Se guarda en su propia base SQLite bajo data/ (no en crypto.db, asi se puede
+# borrar sin perder datos). Cada respuesta se guarda con su ETag / Last-Modified:
+# mientras esta fresca (TTL por endpoint) se sirve sin red; vencida, se
+# revalida con If-None-Match / If-Modified-Since y un 304 reutiliza el cuerpo
+# guardado. El llamador puede pedir un TTL menor (ej. el de su cache en memoria):
+# la frescura se evalua al leer con la edad de la entrada, asi dos llamadas a la
+# misma URL con TTL distintos no se sirven mas viejas de lo que cada una acepta.
+# El tamaño total se acota expulsando las menos usadas (LRU).
+#
+# Variables de entorno:
+#   CRYPTOAI_HTTP_CACHE=0         desactiva el cache en disco
+#   CRYPTOAI_HTTP_CACHE_MB=200    tamaño maximo de los cuerpos guardados
+
+import os
+import threading
+import time
+
+from db import get_connection, transaction
+
+HTTP_CACHE_PATH = os.path.join("data", "http_cache.db")
+HTTP_CACHE_MAX_BYTES = int(float(os.environ.get("CRYPTOAI_HTTP_CACHE_MB", 200)) * 1024 * 1024)
+
+# (sufijo del endpoint, segundos frescos). Se usa el primero que coincide.
+ENDPOINT_TTLS = [
+    ('/market_chart/range', 7 * 24 * 60 * 60),  # ventanas cerradas: no cambian
+    ('/market_chart', 10 * 60),
+    ('/ohlc', 30 * 60),
+]
+DEFAULT_TTL = 5 * 60
+# Un rango que termina dentro del ultimo dia diario aun puede cambiar
+CLOSED_RANGE_AGE = 24 * 60 * 60
+
+
+def endpoint_ttl(path: str, max_ttl: float = None, params: dict = None) -> float:
+    """
+    Segundos frescos del endpoint, acotados a max_ttl si el llamador lo indica.
+
+    /market_chart/range solo recibe el TTL largo si su 'to' (segundos UNIX) es
+    anterior a CLOSED_RANGE_AGE; si llega hasta ahora se trata como /market_chart.
+    """
+    path = path.split('?', 1)[0].rstrip('/')
+    if path.endswith('/market_chart/range'):
+        to = (params or {}).get('to')
+        if to is None or float(to) > time.time() - CLOSED_RANGE_AGE:
+            path = path[:-len('/range')]
+    ttl = next((seconds for suffix, seconds in ENDPOINT_TTLS if path.endswith(suffix)), DEFAULT_TTL)
+    return ttl if max_ttl is None else min(ttl, max_ttl)
+
+
+class DiskCache:
+    """
+    Cache de respuestas en SQLite con expiracion por entrada y limite de tamaño LRU.
+
+    Parámetros:
+    - path: archivo SQLite del cache
+    - max_bytes: suma maxima de los cuerpos guardados
+    """
+
+    def __init__(self, path: str = HTTP_CACHE_PATH, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._revalidated = 0
+        self._misses = 0
+        with transaction(self.path) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    etag TEXT,
+                    last_modified TEXT,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    stored_at REAL NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(responses)")}
+            if 'stored_at' not in columns:
+                # Cache creado antes de stored_at: sus entradas se revalidan al usarse
+                conn.execute("ALTER TABLE responses ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+
+    def get(self, key: str, max_age: float = None):
+        """
+        Retorna (fresca, body, etag, last_modified) o None si no hay entrada.
+        Con max_age la entrada solo es fresca si ademas se guardo (o revalido)
+        hace menos de max_age segundos.
+        """
+        row = get_connection(self.path).execute(
+            "SELECT body, etag, last_modified, expires_at, stored_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, expires_at, stored_at = row
+        now = time.time()
+        fresh = expires_at > now and (max_age is None or now - stored_at < max_age)
+        return fresh, body, etag, last_modified
+
+    def put(self, key: str, body: bytes, ttl: float, etag: str = None, last_modified: str = None):
+        now = time.time()
+        with transaction(self.path) as conn:
+            conn.execute("""
+                INSERT INTO responses (key, etag, last_modified, body, size, expires_at, last_access, stored_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    etag = excluded.etag, last_modified = excluded.last_modified, body = excluded.body,
+                    size = excluded.size, expires_at = excluded.expires_at, last_access = excluded.last_access,
+                    stored_at = excluded.stored_at
+            """, (key, etag, last_modified, body, len(body), now + ttl, now, now))
+            self._evict(conn)
+
+    def touch(self, key: str, ttl: float = None):
+        """
+        Marca la entrada como usada; con ttl (tras un 304) la vuelve a dar por fresca.
+        """
+        now = time.time()
+        with transaction(self.path) as conn:
+            if ttl is None:
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            else:
+                conn.execute("UPDATE responses SET last_access = ?, expires_at = ?, stored_at = ? WHERE key = ?",
+                             (now, now + ttl, now, key))
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Las menos usadas primero, hasta volver bajo el limite
+        doomed, freed = [], 0
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY last_access"):
+            if total - freed <= self.max_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def record(self, outcome: str):
+        with self._lock:
+            if outcome == 'hit':
+                self._hits += 1
+            elif outcome == 'revalidated':
+                self._revalidated += 1
+            else:
+                self._misses += 1
+
+    def clear(self):
+        with transaction(self.path) as conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        row = get_connection(self.path).execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        with self._lock:
+            return {"entries": row[0], "bytes": row[1], "hits": self._hits,
+                    "revalidated": self._revalidated, "misses": self._misses}
+
+
+_disk_cache = None
+_disk_cache_lock = threading.Lock()
+
+
+def is_enabled() -> bool:
+    return os.environ.get("CRYPTOAI_HTTP_CACHE", "1") != "0"
+
+
+def get_disk_cache():
+    """
+    Cache en disco compartido del proceso, o None si esta desactivado.
+    """
+    global _disk_cache
+    if not is_enabled():
+        return None
+    with _disk_cache_lock:
+        if _disk_cache is None:
+            _disk_cache = DiskCache()
+    return _disk_cache
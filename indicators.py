@@ -0,0 +1,317 @@
+# Indicadores tecnicos sobre OHLC / precios de cierre
+
+# Calculo completo vectorizado (rolling / ewm de pandas) y actualizacion
+# incremental desde el estado de la cola: al llegar velas nuevas solo se
+# procesan esas velas, con costo por vela independiente del largo del historico.
+#
+# Acepta los DataFrames de fetch_ohlc_with_volume / get_ohlc_dataframe
+# (date, open, high, low, close, volume) y de load_from_db (date, price_usd, que
+# se usa como close). ATR y VWAP se omiten si faltan high/low/volume.
+
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_PARAMS = {
+    'sma': 20,
+    'ema': 20,
+    'rsi': 14,
+    'macd': (12, 26, 9),
+    'bollinger': (20, 2.0),
+    'atr': 14,
+}
+
+
+def _close(df: pd.DataFrame) -> pd.Series:
+    return (df['close'] if 'close' in df.columns else df['price_usd']).astype(float)
+
+
+def _has_ohlcv(df: pd.DataFrame) -> bool:
+    return {'high', 'low', 'close', 'volume'}.issubset(df.columns)
+
+
+# ===========================
+# Calculo vectorizado
+# ===========================
+def sma(close: pd.Series, window: int) -> pd.Series:
+    return close.rolling(window).mean()
+
+
+def ema(close: pd.Series, span: int) -> pd.Series:
+    return close.ewm(span=span, adjust=False).mean()
+
+
+def rsi(close: pd.Series, period: int = 14) -> pd.Series:
+    """RSI de Wilder (medias exponenciales con alpha = 1/period)."""
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 - 100 / (1 + gain / loss)
+
+
+def macd(close: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9) -> pd.DataFrame:
+    line = ema(close, fast) - ema(close, slow)
+    signal_line = line.ewm(span=signal, adjust=False).mean()
+    return pd.DataFrame({'macd': line, 'macd_signal': signal_line, 'macd_hist': line - signal_line})
+
+
+def bollinger(close: pd.Series, window: int = 20, k: float = 2.0) -> pd.DataFrame:
+    mid = close.rolling(window).mean()
+    std = close.rolling(window).std(ddof=0)
+    return pd.DataFrame({'bb_mid': mid, 'bb_upper': mid + k * std, 'bb_lower': mid - k * std})
+
+
+def true_range(high: pd.Series, low: pd.Series, close: pd.Series) -> pd.Series:
+    prev_close = close.shift()
+    tr = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+    return tr
+
+
+def atr(high: pd.Series, low: pd.Series, close: pd.Series, period: int = 14) -> pd.Series:
+    """ATR de Wilder."""
+    return true_range(high, low, close).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+
+
+def vwap(high: pd.Series, low: pd.Series, close: pd.Series, volume: pd.Series) -> pd.Series:
+    """VWAP acumulado desde la primera vela, con precio tipico (h + l + c) / 3."""
+    typical = (high + low + close) / 3
+    return (typical * volume).cumsum() / volume.cumsum()
+
+
+def compute_indicators(df: pd.DataFrame, **params) -> pd.DataFrame:
+    """
+    Calcula todos los indicadores sobre el DataFrame completo.
+
+    Parámetros:
+        df: DataFrame con date y close (o price_usd); high/low/volume opcionales
+        params: sobreescribe DEFAULT_PARAMS (sma, ema, rsi, macd, bollinger, atr)
+
+    Retorna:
+        DataFrame con date y una columna por indicador.
+    """
+    p = {**DEFAULT_PARAMS, **params}
+    close = _close(df)
+    out = pd.DataFrame({'date': df['date']})
+    out[f"sma_{p['sma']}"] = sma(close, p['sma'])
+    out[f"ema_{p['ema']}"] = ema(close, p['ema'])
+    out['rsi'] = rsi(close, p['rsi'])
+    out = out.join(macd(close, *p['macd']))
+    out = out.join(bollinger(close, *p['bollinger']))
+    if _has_ohlcv(df):
+        high, low, volume = df['high'].astype(float), df['low'].astype(float), df['volume'].astype(float)
+        out['atr'] = atr(high, low, close, p['atr'])
+        out['vwap'] = vwap(high, low, close, volume)
+    return out
+
+
+# ===========================
+# Calculo incremental
+# ===========================
+class _EMAState:
+    # Misma recurrencia que ewm(adjust=False): e_0 = x_0, e_t = a*x_t + (1-a)*e_{t-1}
+    def __init__(self, alpha: float, min_periods: int = 1):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.value = None
+        self.count = 0
+
+    @classmethod
+    def from_series(cls, alpha: float, series: pd.Series, values: pd.Series, min_periods: int = 1):
+        state = cls(alpha, min_periods)
+        valid = series.dropna()
+        state.count = len(valid)
+        state.value = float(values.dropna().iloc[-1]) if state.count else None
+        return state
+
+    def update(self, x: float) -> float:
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        self.count += 1
+        return self.value if self.count >= self.min_periods else np.nan
+
+
+class IndicatorEngine:
+    """
+    Motor de indicadores con estado: fit() calcula el historico completo de forma
+    vectorizada y guarda el estado de la cola (ultimas ventanas, medias
+    exponenciales, acumulados de VWAP); update() procesa solo las velas nuevas.
+
+    Tambien guarda el estado previo a la ultima vela procesada, para poder
+    recalcularla si llega revisada (la vela en curso cambia hasta que cierra).
+
+    Uso:
+        engine = IndicatorEngine()
+        full = engine.fit(df)
+        nuevas = engine.update(df_nuevas_velas)
+    """
+
+    # Escalares del estado incremental y medias exponenciales (ver _snapshot)
+    _SCALARS = ('last_date', '_last_close', '_cum_pv', '_cum_v')
+    _EMAS = ('_ema', '_ema_fast', '_ema_slow', '_macd_signal', '_gain', '_loss', '_atr')
+
+    def __init__(self, **params):
+        self.params = {**DEFAULT_PARAMS, **params}
+        self.last_date = None
+        self.first_date = None
+        self._before_last = None
+
+    def fit(self, df: pd.DataFrame) -> pd.DataFrame:
+        result = compute_indicators(df, **self.params)
+        self.first_date = df['date'].iloc[0] if len(df) else None
+        self.last_date = None
+        self.ohlcv = _has_ohlcv(df)
+        # Estado hasta la penultima vela; la ultima pasa por _step para guardar
+        # el estado previo a ella (ver sync)
+        self._init_state(df.iloc[:-1], result.iloc[:-1])
+        self._before_last = None
+        if len(df):
+            self._step(df.iloc[-1:])
+        return result
+
+    def _init_state(self, df: pd.DataFrame, result: pd.DataFrame):
+        p = self.params
+        close = _close(df)
+        window = max(p['sma'], p['bollinger'][0])
+        self._closes = deque(close.iloc[-window:].tolist(), maxlen=window)
+        self._last_close = float(close.iloc[-1]) if len(close) else None
+
+        self._ema = _EMAState.from_series(2 / (p['ema'] + 1), close, result[f"ema_{p['ema']}"])
+        fast, slow, signal = p['macd']
+        self._ema_fast = _EMAState.from_series(2 / (fast + 1), close, ema(close, fast))
+        self._ema_slow = _EMAState.from_series(2 / (slow + 1), close, ema(close, slow))
+        self._macd_signal = _EMAState.from_series(2 / (signal + 1), close, result['macd_signal'])
+
+        delta = close.diff()
+        alpha_rsi = 1 / p['rsi']
+        self._gain = _EMAState.from_series(alpha_rsi, delta, delta.clip(lower=0).ewm(alpha=alpha_rsi, adjust=False).mean(), p['rsi'])
+        self._loss = _EMAState.from_series(alpha_rsi, delta, (-delta.clip(upper=0)).ewm(alpha=alpha_rsi, adjust=False).mean(), p['rsi'])
+
+        self._atr, self._cum_pv, self._cum_v = None, 0.0, 0.0
+        if self.ohlcv:
+            high, low, volume = df['high'].astype(float), df['low'].astype(float), df['volume'].astype(float)
+            tr = true_range(high, low, close)
+            self._atr = _EMAState.from_series(1 / p['atr'], tr, tr.ewm(alpha=1 / p['atr'], adjust=False).mean(), p['atr'])
+            typical = (high + low + close) / 3
+            self._cum_pv = float((typical * volume).sum())
+            self._cum_v = float(volume.sum())
+
+    def _snapshot(self) -> dict:
+        # Estado previo a UNA vela: escalares, (valor, n) de cada media y el cierre
+        # que esa vela saca de la ventana. Sin copiar el deque (corre en cada vela).
+        closes = self._closes
+        full = len(closes) == closes.maxlen
+        return {
+            'scalars': [getattr(self, name) for name in self._SCALARS],
+            'emas': [(state.value, state.count) if state is not None else None
+                     for state in (getattr(self, name) for name in self._EMAS)],
+            'evicted': (closes[0],) if full and closes else None,
+        }
+
+    def _restore(self, snapshot: dict):
+        # Deshace la unica vela procesada despues de _snapshot
+        for name, value in zip(self._SCALARS, snapshot['scalars']):
+            setattr(self, name, value)
+        for name, saved in zip(self._EMAS, snapshot['emas']):
+            if saved is not None:
+                state = getattr(self, name)
+                state.value, state.count = saved
+        self._closes.pop()
+        if snapshot['evicted'] is not None:
+            self._closes.appendleft(snapshot['evicted'][0])
+
+    def _update_bar(self, date, c: float, h: float = None, l: float = None, v: float = None) -> dict:
+        p = self.params
+        self._closes.append(c)
+        closes = np.fromiter(self._closes, dtype=float)
+
+        out = {'date': date}
+        w = p['sma']
+        out[f"sma_{w}"] = closes[-w:].mean() if len(closes) >= w else np.nan
+        out[f"ema_{p['ema']}"] = self._ema.update(c)
+
+        if self._last_close is None:
+            delta_gain = delta_loss = None
+        else:
+            delta = c - self._last_close
+            delta_gain, delta_loss = max(delta, 0.0), max(-delta, 0.0)
+        if delta_gain is None:
+            out['rsi'] = np.nan
+        else:
+            gain, loss = self._gain.update(delta_gain), self._loss.update(delta_loss)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                out['rsi'] = 100 - 100 / (1 + np.float64(gain) / np.float64(loss))
+
+        line = self._ema_fast.update(c) - self._ema_slow.update(c)
+        signal = self._macd_signal.update(line)
+        out['macd'], out['macd_signal'], out['macd_hist'] = line, signal, line - signal
+
+        bw, k = p['bollinger']
+        if len(closes) >= bw:
+            window = closes[-bw:]
+            mid, std = window.mean(), window.std()
+            out['bb_mid'], out['bb_upper'], out['bb_lower'] = mid, mid + k * std, mid - k * std
+        else:
+            out['bb_mid'] = out['bb_upper'] = out['bb_lower'] = np.nan
+
+        if self.ohlcv:
+            if self._last_close is None:
+                tr = h - l
+            else:
+                tr = max(h - l, abs(h - self._last_close), abs(l - self._last_close))
+            out['atr'] = self._atr.update(tr)
+            self._cum_pv += (h + l + c) / 3 * v
+            self._cum_v += v
+            out['vwap'] = self._cum_pv / self._cum_v if self._cum_v else np.nan
+
+        self._last_close = c
+        return out
+
+    def _step(self, bars: pd.DataFrame) -> list:
+        # Procesa las velas en orden; antes de la ultima guarda el estado previo
+        # Columnas como listas de Python: iterar filas de pandas domina el costo por vela
+        columns = [bars['date'].tolist(), _close(bars).tolist()]
+        if self.ohlcv:
+            columns += [bars[c].astype(float).tolist() for c in ('high', 'low', 'volume')]
+        rows = []
+        last = len(bars) - 1
+        for i, values in enumerate(zip(*columns)):
+            if i == last:
+                self._before_last = self._snapshot()
+            rows.append(self._update_bar(*values))
+            self.last_date = values[0]
+        return rows
+
+    def update(self, new_bars: pd.DataFrame) -> pd.DataFrame:
+        """
+        Calcula los indicadores solo para las velas posteriores a la ultima procesada.
+
+        Retorna:
+            DataFrame con los indicadores de las velas nuevas (vacio si no hay).
+        """
+        if self.last_date is None:
+            raise RuntimeError("Llamar fit() antes de update()")
+        new_bars = new_bars[new_bars['date'] > self.last_date]
+        if new_bars.empty:
+            return pd.DataFrame()
+        return pd.DataFrame(self._step(new_bars))
+
+    def sync(self, df: pd.DataFrame, result: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Mantiene 'result' (indicadores ya calculados) al dia con 'df'.
+
+        Si df se solapa con lo ya procesado (contiene la ultima vela y no empieza
+        antes que 'result'), se recalcula desde la ultima vela (pudo cambiar) y se
+        agregan las nuevas; las filas de result anteriores al inicio de df se
+        descartan, asi una ventana deslizante (start = ahora - days) sigue siendo
+        incremental. Si no hay solape se recalcula todo.
+        """
+        if (result is None or self.last_date is None or self._before_last is None or df.empty
+                or df['date'].iloc[0] < self.first_date or not (df['date'] == self.last_date).any()):
+            return self.fit(df)
+        stored_last = self.last_date
+        self._restore(self._before_last)
+        rows = pd.DataFrame(self._step(df[df['date'] >= stored_last]))
+        result = pd.concat([result[result['date'] < stored_last], rows], ignore_index=True)
+        self.first_date = df['date'].iloc[0]
+        return result[result['date'] >= self.first_date].reset_index(drop=True)
@@ -1,29 +1,123 @@
-
 #CryptoAI
 #│
-#├── main.py                         # Script principal (ejecucion)
+#├── main.py                         # CLI batch (cron / servidor sin pantalla)
 #├── app_streamlit.py                # UI WEB
 #├── api.py                          # Lógica de conexión con CoinGecko
 #├── processing.py                   # Procesamiento de datos crudos (DataFrame, fechas, etc.)
 #├── plotter.py                      # Todas las funciones de visualización (plot_comparison_with_marker)
 #└── requirements.txt                # (opcional) para definir dependencias como `plotly`, `pandas`, etc.
 
+# Uso:
+#   python main.py                                   # watchlist completa, HTML + CSV en output/
+#   python main.py --coins bitcoin solana --figure-format png --table-format parquet
+#   python main.py --skip-refresh --output-dir /srv/cryptoai/reportes
 
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
 
-from processing import get_historical_price_dataframe
-from plotter import plot_comparison_with_marker
+import pandas as pd
+
+from processing import AVAILABLE_COINS, compute_positions, create_db, get_historical_price_dataframes, load_from_db
+from plotter import MAX_POINTS_PER_TRACE, build_price_grid, build_roi_figure
+
+
+@contextmanager
+def _stage(name: str, timings: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = time.perf_counter() - start
+        print(f"[{name}] {timings[name]:.2f}s")
+
+
+def _write_table(df: pd.DataFrame, path: str, table_format: str) -> str:
+    path = f"{path}.{table_format}"
+    if table_format == "parquet":
+        df.to_parquet(path, index=False)  # requiere pyarrow
+    else:
+        df.to_csv(path, index=False)
+    return path
+
+
+def _write_figure(fig, path: str, figure_format: str) -> str:
+    path = f"{path}.{figure_format}"
+    if figure_format == "png":
+        fig.write_image(path)  # requiere kaleido
+    else:
+        fig.write_html(path, include_plotlyjs="cdn")
+    return path
 
-if __name__ == "__main__":
-    df_algorand = get_historical_price_dataframe("algorand")
-    df_solana = get_historical_price_dataframe("solana")
 
-    plot_comparison_with_marker(
-        df1=df_algorand,
-        df2=df_solana,
-        name1="Algorand",
-        name2="Solana",
-        marker_date="2024-11-01",
-        investment_amount=500
-    )
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="CryptoAI - actualizacion de precios y reporte de ganancias sin UI")
+    parser.add_argument("--coins", nargs="+", default=AVAILABLE_COINS, help="IDs de CoinGecko (por defecto la watchlist)")
+    parser.add_argument("--days", type=int, default=365, help="dias de historico para monedas sin datos")
+    parser.add_argument("--workers", type=int, default=None, help="descargas en paralelo")
+    parser.add_argument("--output-dir", default="output", help="directorio de salida")
+    parser.add_argument("--figure-format", choices=["html", "png"], default="html")
+    parser.add_argument("--table-format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--max-points", type=int, default=MAX_POINTS_PER_TRACE,
+                        help="puntos por linea en las graficas (0 = todos)")
+    parser.add_argument("--skip-refresh", action="store_true", help="no llamar a la API, solo leer SQLite")
+    return parser.parse_args(argv)
 
 
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    os.makedirs(args.output_dir, exist_ok=True)
+    timings = {}
+    outputs = []
+
+    # 1. Calentar / actualizar historicos de la watchlist en paralelo
+    with _stage("precios", timings):
+        if args.skip_refresh:
+            create_db()
+            coin_dataframes = {c: df for c in args.coins if (df := load_from_db(c)) is not None}
+            errors = {c: ValueError("sin datos en la base") for c in args.coins if c not in coin_dataframes}
+        else:
+            coin_dataframes, errors = get_historical_price_dataframes(args.coins, days=args.days,
+                                                                      max_workers=args.workers)
+    for coin, e in errors.items():
+        print(f"❌ Error al obtener datos de {coin.upper()}: {e}", file=sys.stderr)
+
+    # 2. Tabla de ganancias a partir de la tabla investments
+    with _stage("ganancias", timings):
+        df_result, totales, errores = compute_positions()
+    for err in errores.itertuples(index=False):
+        print(f"❌ {err.coin_id.upper()} - {err.fecha_inversion}: {err.error}", file=sys.stderr)
+
+    # 3. Tablas de salida
+    with _stage("tablas", timings):
+        if coin_dataframes:
+            prices = pd.concat(
+                [df[['date', 'price_usd']].assign(coin_id=coin) for coin, df in coin_dataframes.items()],
+                ignore_index=True
+            )[['coin_id', 'date', 'price_usd']]
+            outputs.append(_write_table(prices, os.path.join(args.output_dir, "precios"), args.table_format))
+        outputs.append(_write_table(df_result, os.path.join(args.output_dir, "ganancias"), args.table_format))
+
+    # 4. Graficas estaticas (sin abrir navegador)
+    with _stage("graficas", timings):
+        if coin_dataframes:
+            outputs.append(_write_figure(build_price_grid(coin_dataframes, max_points=args.max_points or None),
+                                         os.path.join(args.output_dir, "precios"), args.figure_format))
+        if not df_result.empty:
+            outputs.append(_write_figure(build_roi_figure(df_result),
+                                         os.path.join(args.output_dir, "roi"), args.figure_format))
+
+    print(f"Ganancia total: ${totales['ganancia_total']:,.2f} | Valor actual: ${totales['valor_total']:,.2f} "
+          f"| ROI: {totales['roi_total']:.2%}")
+    for path in outputs:
+        print(f"→ {path}")
+    print("Tiempos: " + ", ".join(f"{name}={seconds:.2f}s" for name, seconds in timings.items())
+          + f", total={sum(timings.values()):.2f}s")
+
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# Migraciones versionadas del esquema SQLite (PRAGMA user_version)
+
+import sqlite3
+import threading
+
+from db import DB_PATH, transaction
+from rollups import create_rollup_tables, refresh_rollups
+
+
+def _migration_1_base_tables(conn: sqlite3.Connection):
+    """Esquema original: fechas TEXT (no-op en bases ya existentes)."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS prices (
+            coin_id TEXT,
+            date TEXT,
+            price_usd REAL,
+            PRIMARY KEY (coin_id, date)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS investments (
+            coin_id TEXT,
+            date TEXT,
+            investor TEXT,
+            amount REAL,
+            note TEXT,
+            PRIMARY KEY (coin_id, date, investor)
+        )
+    """)
+
+
+# Convierte TEXT ISO (con o sin hora) a epoch ms; las fechas invalidas dan NULL
+_TEXT_TO_EPOCH_MS = "CAST(ROUND((julianday({col}) - 2440587.5) * 86400000) AS INTEGER)"
+
+
+def _keep_rejected(conn: sqlite3.Connection, table: str, match: str) -> int:
+    """
+    Copia a {table}_rejected las filas de la tabla vieja sin equivalente en
+    {table}_v2 (fecha invalida, clave nula o pisadas por otra fila con la misma
+    clave al pasar a minusculas / epoch ms), antes de borrar la tabla vieja.
+    Retorna cuantas filas se copiaron.
+    """
+    where = f"NOT EXISTS (SELECT 1 FROM {table}_v2 v WHERE {match})"
+    rejected = conn.execute(f"SELECT COUNT(*) FROM {table} o WHERE {where}").fetchone()[0]
+    if rejected:
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_rejected AS SELECT * FROM {table} o WHERE {where}")
+        print(f"[migrate] {table}: {rejected} filas no migradas, copiadas a {table}_rejected")
+    return rejected
+
+
+def _migration_2_epoch_dates(conn: sqlite3.Connection):
+    """
+    Fechas como INTEGER epoch ms, coin_id en minusculas e indices para rangos
+    (coin_id, date). prices pasa a WITHOUT ROWID: la PK agrupa las filas por
+    (coin_id, date) y cubre price_usd, asi un rango es un solo recorrido del B-tree.
+    """
+    conn.execute("""
+        CREATE TABLE prices_v2 (
+            coin_id TEXT NOT NULL,
+            date INTEGER NOT NULL,
+            price_usd REAL,
+            PRIMARY KEY (coin_id, date)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        INSERT OR REPLACE INTO prices_v2 (coin_id, date, price_usd)
+        SELECT LOWER(coin_id), {_TEXT_TO_EPOCH_MS.format(col='date')}, price_usd
+        FROM prices
+        WHERE coin_id IS NOT NULL AND julianday(date) IS NOT NULL
+    """)
+    _keep_rejected(conn, 'prices', f"""
+        v.coin_id = LOWER(o.coin_id) AND v.date = {_TEXT_TO_EPOCH_MS.format(col='o.date')}
+        AND v.price_usd IS o.price_usd
+    """)
+    conn.execute("DROP TABLE prices")
+    conn.execute("ALTER TABLE prices_v2 RENAME TO prices")
+
+    conn.execute("""
+        CREATE TABLE investments_v2 (
+            coin_id TEXT NOT NULL,
+            date INTEGER NOT NULL,
+            investor TEXT NOT NULL,
+            amount REAL,
+            note TEXT,
+            PRIMARY KEY (coin_id, date, investor)
+        )
+    """)
+    conn.execute(f"""
+        INSERT OR IGNORE INTO investments_v2 (coin_id, date, investor, amount, note)
+        SELECT LOWER(coin_id), {_TEXT_TO_EPOCH_MS.format(col='date')}, investor, amount, note
+        FROM investments
+        WHERE coin_id IS NOT NULL AND investor IS NOT NULL AND julianday(date) IS NOT NULL
+    """)
+    _keep_rejected(conn, 'investments', f"""
+        v.coin_id = LOWER(o.coin_id) AND v.date = {_TEXT_TO_EPOCH_MS.format(col='o.date')}
+        AND v.investor = o.investor AND v.amount IS o.amount AND v.note IS o.note
+    """)
+    conn.execute("DROP TABLE investments")
+    conn.execute("ALTER TABLE investments_v2 RENAME TO investments")
+    # Indice cubriente para consultas por moneda y rango de fechas (sin leer la tabla)
+    conn.execute("""
+        CREATE INDEX idx_investments_coin_date
+        ON investments (coin_id, date, investor, amount)
+    """)
+    conn.execute("CREATE INDEX idx_investments_date ON investments (date)")
+
+
+def _migration_3_ohlc(conn: sqlite3.Connection):
+    """Velas OHLC + volumen por moneda, moneda de cotizacion y granularidad."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ohlc (
+            coin_id TEXT NOT NULL,
+            vs_currency TEXT NOT NULL,
+            granularity TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            volume REAL,
+            PRIMARY KEY (coin_id, vs_currency, granularity, ts)
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_4_refresh_log(conn: sqlite3.Connection):
+    """Ultimo refresco programado de precios por moneda."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_log (
+            coin_id TEXT PRIMARY KEY,
+            last_refresh INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            error TEXT
+        )
+    """)
+
+
+def _migration_5_backfill_windows(conn: sqlite3.Connection):
+    """Ventanas de backfill ya guardadas, para reanudar descargas largas."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS backfill_windows (
+            coin_id TEXT NOT NULL,
+            vs_currency TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            window_end INTEGER NOT NULL,
+            rows INTEGER NOT NULL,
+            completed_at INTEGER NOT NULL,
+            PRIMARY KEY (coin_id, vs_currency, window_start)
+        ) WITHOUT ROWID
+    """)
+
+
+def _migration_6_rollups(conn: sqlite3.Connection):
+    """Agregados diarios y semanales de prices, poblados con el historico existente."""
+    create_rollup_tables(conn)
+    refresh_rollups(conn)
+
+
+def _migration_7_pending_backfill_windows(conn: sqlite3.Connection):
+    """
+    backfill_windows registra tambien las ventanas planeadas y aun no guardadas
+    (completed_at NULL), para que el refresco normal las reanude.
+    """
+    conn.execute("""
+        CREATE TABLE backfill_windows_v2 (
+            coin_id TEXT NOT NULL,
+            vs_currency TEXT NOT NULL,
+            window_start INTEGER NOT NULL,
+            window_end INTEGER NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            completed_at INTEGER,
+            PRIMARY KEY (coin_id, vs_currency, window_start)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO backfill_windows_v2 (coin_id, vs_currency, window_start, window_end, rows, completed_at)
+        SELECT coin_id, vs_currency, window_start, window_end, rows, completed_at FROM backfill_windows
+    """)
+    conn.execute("DROP TABLE backfill_windows")
+    conn.execute("ALTER TABLE backfill_windows_v2 RENAME TO backfill_windows")
+
+
+def _migration_8_sparse_ohlc(conn: sqlite3.Connection):
+    """
+    Las velas de 30 min / 4 h se guardaban unidas por fecha exacta al volumen
+    diario, asi que solo quedaban las de medianoche. Se borran para que
+    get_ohlc_dataframe las descargue completas (la tabla es un cache de la API).
+    """
+    conn.execute("DELETE FROM ohlc WHERE granularity IN ('30m', '4h')")
+
+
+# (version, descripcion, funcion). Agregar siempre al final con version consecutiva.
+MIGRATIONS = [
+    (1, "tablas base prices / investments", _migration_1_base_tables),
+    (2, "fechas epoch ms, coin_id en minusculas e indices", _migration_2_epoch_dates),
+    (3, "tabla ohlc", _migration_3_ohlc),
+    (4, "tabla refresh_log", _migration_4_refresh_log),
+    (5, "tabla backfill_windows", _migration_5_backfill_windows),
+    (6, "agregados prices_daily / prices_weekly", _migration_6_rollups),
+    (7, "ventanas de backfill pendientes", _migration_7_pending_backfill_windows),
+    (8, "borrar velas ohlc de 30m / 4h incompletas", _migration_8_sparse_ohlc),
+]
+
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path: str = None) -> int:
+    """
+    Aplica en orden las migraciones pendientes de la base (actualiza en sitio
+    bases existentes). Cada migracion corre en su propia transaccion junto con
+    el cambio de user_version, de modo que una falla no deja la base a medias.
+
+    Retorna:
+        Version final del esquema.
+    """
+    path = path or DB_PATH
+    if path in _migrated:
+        return MIGRATIONS[-1][0]
+
+    with _migrate_lock:
+        version = 0
+        for target, description, apply in MIGRATIONS:
+            with transaction(path) as conn:
+                # Se relee dentro del lock de escritura por si otro proceso ya migro
+                version = get_schema_version(conn)
+                if version >= target:
+                    continue
+                print(f"[migrate] {path}: v{version} -> v{target} ({description})")
+                apply(conn)
+                conn.execute(f"PRAGMA user_version = {target}")
+                version = target
+        _migrated.add(path)
+    return version
@@ -1,7 +1,6 @@
 import streamlit as st
-import pandas as pd
-from processing import get_all_investments, process_price_data_from_db
-from datetime import datetime
+from processing import get_all_investments, compute_positions
+from portfolio import portfolio_history
 import plotly.express as px
 
 
@@ -21,60 +20,19 @@ if df_invest.empty:
     st.info("Aún no se han registrado inversiones.")
     st.stop()
 
-df_invest['date'] = pd.to_datetime(df_invest['date'])
+# 2. Cálculo vectorizado: un join as-of por moneda para el precio de compra
+#    y el ultimo precio guardado como precio actual
+df_result, totales, errores = compute_positions(df_invest)
 
-# 2. Cálculo fila por fila (sin agrupar), para más precisión
-results = []
-
-for _, row in df_invest.iterrows():
-    coin = row['coin_id']
-    fecha_inversion = row['date']
-    monto_invertido = row['amount']
-
-    try:
-        # 3. Obtener historico de precios
-        df_price = process_price_data_from_db(coin)
-
-        # 4. Precio más cercano a la fecha de inversion
-        df_hist = df_price[df_price['date'] <= fecha_inversion]
-        if df_hist.empty:
-            raise ValueError("No hay precio anterior a la fecha de inversión")
-        precio_compra = df_hist.iloc[-1]['price_usd']
-
-        # 5. Precio mas reciente disponible (hoy)
-        precio_actual = df_price.iloc[-1]['price_usd']
-
-        # 6. Calcular unidades compradas
-        unidades = monto_invertido / precio_compra
-
-        # 7. Calcular valor actual
-        valor_actual = unidades * precio_actual
-        ganancia = valor_actual - monto_invertido
-        roi = ganancia / monto_invertido
-
-        results.append({
-            'coin_id': coin,
-            'fecha_inversion': fecha_inversion.date(),
-            'monto_invertido': monto_invertido,
-            'precio_compra': precio_compra,
-            'precio_actual': precio_actual,
-            'unidades': unidades,
-            'valor_actual': valor_actual,
-            'ganancia': ganancia,
-            'roi': roi
-        })
-
-    except Exception as e:
-        st.warning(f"❌ {coin.upper()} - {fecha_inversion.date()}: {e}")
-
-# 8. Mostrar resultados
-if results:
-    df_result = pd.DataFrame(results)
+for err in errores.itertuples(index=False):
+    st.warning(f"❌ {err.coin_id.upper()} - {err.fecha_inversion}: {err.error}")
 
+# 3. Mostrar resultados
+if not df_result.empty:
     # 💰 Ganancia total acumulada
-    ganancia_total = df_result['ganancia'].sum()
-    valor_total = df_result['valor_actual'].sum()
-    roi_total = ganancia_total / df_result['monto_invertido'].sum()
+    ganancia_total = totales['ganancia_total']
+    valor_total = totales['valor_total']
+    roi_total = totales['roi_total']
 
     st.subheader("📊 Indicadores globales")
 
@@ -94,7 +52,7 @@ if results:
         'roi': '{:.2%}'
     }), use_container_width=True)
 
-    # 9. Grafico de ROI por moneda
+    # 4. Grafico de ROI por moneda
 
     fig_roi = px.bar(
         df_result,
@@ -107,9 +65,19 @@ if results:
     fig_roi.update_traces(textposition="outside", textfont_size=12)
     st.plotly_chart(fig_roi, use_container_width=True)
 
-    # 10. Grafico de valor actual
+    # 5. Grafico de valor actual
     fig_valor = px.bar(df_result, x='coin_id', y='valor_actual', color='coin_id',
                        title="Valor actual de la inversión por moneda")
     st.plotly_chart(fig_valor, use_container_width=True)
+
+    # 6. Evolucion diaria del portafolio (motor incremental compartido por el proceso)
+    st.subheader("📅 Evolución del portafolio")
+    por_inversor, total, _ = portfolio_history(df_invest)
+    if not total.empty:
+        col1, col2 = st.columns(2)
+        fig_nav = px.line(total, x='date', y=['valor', 'costo'], title="Valor vs costo acumulado (total)")
+        col1.plotly_chart(fig_nav, use_container_width=True)
+        fig_inv = px.line(por_inversor, x='date', y='ganancia', color='investor', title="Ganancia diaria por inversor")
+        col2.plotly_chart(fig_inv, use_container_width=True)
 else:
     st.info("No se pudieron calcular ganancias actuales.")
@@ -1,6 +1,9 @@
 import streamlit as st
-from api import fetch_ohlc_with_volume
+from api import OHLC_VALID_DAYS
+from processing import get_ohlc_dataframe
+from indicators import IndicatorEngine, DEFAULT_PARAMS
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 
 # ========================
 # Configuracion de pagina
@@ -28,12 +31,33 @@ raw_days = st.slider(
 )
 
 # CoinGecko solo acepta estos valores
-valid_days = [1, 7, 14, 30, 90, 180, 365]
+valid_days = OHLC_VALID_DAYS
 # Buscar el mas cercano
 days = min(valid_days, key=lambda x: abs(x - raw_days))
 
+overlays = st.multiselect(
+    "Indicadores sobre el precio",
+    options=["SMA", "EMA", "Bollinger", "VWAP"],
+    default=["SMA", "Bollinger"]
+)
+oscillators = st.multiselect(
+    "Osciladores",
+    options=["RSI", "MACD", "ATR"],
+    default=["RSI"]
+)
 
 
+def get_indicators(df, key):
+    """
+    Indicadores de df reutilizando el motor guardado en la sesion: si df se
+    solapa con lo ya calculado (aunque la ventana de 'days' se haya corrido), solo
+    se recalculan la ultima vela guardada y las nuevas.
+    """
+    state = st.session_state.setdefault("indicators", {})
+    engine, result = state.get(key, (IndicatorEngine(), None))
+    result = engine.sync(df, result)
+    state[key] = (engine, result)
+    return result
 
 
 
@@ -42,12 +66,18 @@ days = min(valid_days, key=lambda x: abs(x - raw_days))
 # ========================
 if st.button("📊 Mostrar gráfico de velas + volumen"):
     with st.spinner("Consultando datos..."):
-        df = fetch_ohlc_with_volume(coin_id=coin_id, days=days)
+        # Se sirve desde SQLite; solo se descarga el rango o la cola que falte
+        df = get_ohlc_dataframe(coin_id=coin_id, days=days)
 
         if df.empty:
             st.warning("No se obtuvieron datos. Intenta con otra moneda o rango de días.")
         else:
-            fig = go.Figure()
+            ind = get_indicators(df, (coin_id, days))
+            rows = 2 + len(oscillators)
+            fig = make_subplots(
+                rows=rows, cols=1, shared_xaxes=True, vertical_spacing=0.03,
+                row_heights=[0.5, 0.15] + [0.35 / max(len(oscillators), 1)] * len(oscillators)
+            )
 
             # --- Candlestick ---
             fig.add_trace(go.Candlestick(
@@ -57,7 +87,20 @@ if st.button("📊 Mostrar gráfico de velas + volumen"):
                 low=df['low'],
                 close=df['close'],
                 name='OHLC'
-            ))
+            ), row=1, col=1)
+
+            # --- Indicadores sobre el precio ---
+            if "SMA" in overlays:
+                col = f"sma_{DEFAULT_PARAMS['sma']}"
+                fig.add_trace(go.Scatter(x=ind['date'], y=ind[col], name=col.upper(), line=dict(width=1)), row=1, col=1)
+            if "EMA" in overlays:
+                col = f"ema_{DEFAULT_PARAMS['ema']}"
+                fig.add_trace(go.Scatter(x=ind['date'], y=ind[col], name=col.upper(), line=dict(width=1)), row=1, col=1)
+            if "Bollinger" in overlays:
+                for col in ('bb_upper', 'bb_lower'):
+                    fig.add_trace(go.Scatter(x=ind['date'], y=ind[col], name=col, line=dict(width=1, dash='dot', color='gray')), row=1, col=1)
+            if "VWAP" in overlays and 'vwap' in ind:
+                fig.add_trace(go.Scatter(x=ind['date'], y=ind['vwap'], name='VWAP', line=dict(width=1)), row=1, col=1)
 
             # --- Volumen ---
             fig.add_trace(go.Bar(
@@ -67,24 +110,31 @@ if st.button("📊 Mostrar gráfico de velas + volumen"):
                     'green' if c >= o else 'red'
                     for o, c in zip(df['open'], df['close'])
                 ],
-                name='Volumen',
-                yaxis='y2'
-            ))
+                name='Volumen'
+            ), row=2, col=1)
+
+            # --- Osciladores ---
+            for i, name in enumerate(oscillators, start=3):
+                if name == "RSI":
+                    fig.add_trace(go.Scatter(x=ind['date'], y=ind['rsi'], name='RSI'), row=i, col=1)
+                    fig.add_hline(y=70, line_dash='dot', line_color='red', row=i, col=1)
+                    fig.add_hline(y=30, line_dash='dot', line_color='green', row=i, col=1)
+                elif name == "MACD":
+                    fig.add_trace(go.Scatter(x=ind['date'], y=ind['macd'], name='MACD'), row=i, col=1)
+                    fig.add_trace(go.Scatter(x=ind['date'], y=ind['macd_signal'], name='Señal'), row=i, col=1)
+                    fig.add_trace(go.Bar(x=ind['date'], y=ind['macd_hist'], name='Histograma'), row=i, col=1)
+                elif name == "ATR" and 'atr' in ind:
+                    fig.add_trace(go.Scatter(x=ind['date'], y=ind['atr'], name='ATR'), row=i, col=1)
+                fig.update_yaxes(title_text=name, row=i, col=1)
 
             # --- Layout combinado ---
             fig.update_layout(
                 title=f"{coin_id.capitalize()} - Gráfico de Velas + Volumen ({days} días)",
-                xaxis=dict(title="Fecha"),
-                yaxis=dict(title="Precio"),
-                yaxis2=dict(
-                    title="Volumen",
-                    overlaying="y",
-                    side="right",
-                    showgrid=False,
-                    range=[0, df['volume'].max() * 3]
-                ),
-                height=600,
+                xaxis_rangeslider_visible=False,
+                height=600 + 200 * len(oscillators),
                 legend=dict(orientation="h", y=1.02)
             )
+            fig.update_yaxes(title_text="Precio", row=1, col=1)
+            fig.update_yaxes(title_text="Volumen", row=2, col=1)
 
             st.plotly_chart(fig, use_container_width=True)
@@ -0,0 +1,156 @@
+# Decodificacion de las respuestas de CoinGecko directo a arrays NumPy
+
+# /market_chart y /ohlc devuelven listas de pares [timestamp_ms, valor] (o filas
+# [t, o, h, l, c]). Decodificarlas como listas de Python y armar un DataFrame
+# crea un objeto por numero; aqui los numeros del arreglo se leen directamente
+# de los bytes del cuerpo con np.fromstring y se copian a arrays int64 / float64
+# preasignados. Si el arreglo no tiene la forma esperada (null, strings, filas
+# de distinto largo) se decodifica el JSON completo: con orjson si esta
+# instalado, si no con json de la libreria estandar. De /market_chart solo se
+# convierten las series que se leen (ver MarketChart).
+
+import json
+import re
+import threading
+import warnings
+from collections.abc import Mapping
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+
+def loads(body):
+    """
+    Decodifica un cuerpo JSON (bytes o str) con orjson si esta disponible.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _split_rows(flat: np.ndarray, width: int) -> tuple:
+    # Columna 0 -> timestamps int64, resto -> valores float64 (1 columna se aplana)
+    n = len(flat) // width
+    timestamps = np.empty(n, dtype=np.int64)
+    values = np.empty((n, width - 1), dtype=np.float64)
+    rows = flat.reshape(n, width)
+    timestamps[:] = rows[:, 0]
+    values[:] = rows[:, 1:]
+    return timestamps, (values[:, 0] if width == 2 else values)
+
+
+def rows_to_arrays(rows: list, width: int = 2) -> tuple:
+    """
+    Filas ya decodificadas ([[t, v], ...]) a (timestamps int64, valores float64).
+    Los null quedan como NaN.
+    """
+    if not len(rows):
+        return _split_rows(np.empty(0), width)
+    flat = np.array(rows, dtype=np.float64)
+    if flat.ndim != 2 or flat.shape[1] != width:
+        raise ValueError(f"Se esperaban filas de {width} valores, forma recibida {flat.shape}")
+    return _split_rows(flat.ravel(), width)
+
+
+_ROWS_END = re.compile(rb"\]\s*\]")
+
+
+def _scan_rows(body: bytes, start: int, width: int):
+    """
+    Lee el arreglo de filas numericas que empieza en body[start] ('[') sin
+    decodificar el JSON. Retorna el array plano o None si no tiene la forma esperada.
+    """
+    inner = body[start + 1:start + 64].lstrip()
+    if inner.startswith(b"]"):
+        return np.empty(0)
+    end = _ROWS_END.search(body, start + 1)
+    if end is None:
+        return None
+    segment = body[start + 1:end.start() + 1]
+    n = segment.count(b"[")
+    with warnings.catch_warnings():
+        # Un valor no numerico corta la lectura con un DeprecationWarning
+        warnings.simplefilter("ignore", DeprecationWarning)
+        try:
+            flat = np.fromstring(segment.translate(None, b"[]"), dtype=np.float64, sep=",")
+        except ValueError:
+            return None
+    return flat if len(flat) == n * width else None
+
+
+def _key_start(body: bytes, key: str):
+    match = re.search(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*\[', body)
+    return None if match is None else match.end() - 1
+
+
+class MarketChart(Mapping):
+    """
+    Respuesta de /market_chart o /market_chart/range como mapeo de solo lectura
+    {'prices' | 'market_caps' | 'total_volumes': (timestamps int64, valores float64)}.
+
+    Cada serie se convierte a arrays la primera vez que se pide: process_price_data
+    solo lee 'prices' y fetch_ohlc_with_volume solo 'total_volumes', asi no se paga
+    por las series que nadie usa. Se comparte entre hilos (cache de api.py).
+    """
+
+    def __init__(self, body: bytes):
+        self._body = body
+        self._arrays = {}
+        self._data = None  # JSON completo, solo si hizo falta decodificarlo
+        self._lock = threading.Lock()
+
+    def _decoded(self) -> dict:
+        if self._data is None:
+            self._data = loads(self._body)
+        return self._data
+
+    def _parse(self, key: str) -> tuple:
+        start = _key_start(self._body, key)
+        flat = None if start is None else _scan_rows(self._body, start, 2)
+        if flat is not None:
+            return _split_rows(flat, 2)
+        return rows_to_arrays(self._decoded()[key] or [], 2)
+
+    def __getitem__(self, key: str) -> tuple:
+        with self._lock:
+            if key not in self._arrays:
+                self._arrays[key] = self._parse(key)
+            return self._arrays[key]
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._decoded()))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._decoded())
+
+
+def parse_market_chart(body) -> MarketChart:
+    """
+    Cuerpo de /market_chart o /market_chart/range a un MarketChart (series
+    convertidas a arrays al pedirlas).
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    return MarketChart(body)
+
+
+def parse_ohlc(body) -> tuple:
+    """
+    Cuerpo de /ohlc ([[t, o, h, l, c], ...]) a arrays.
+
+    Retorna:
+        (timestamps int64, valores float64 de forma (n, 4) con open, high, low, close)
+    """
+    if isinstance(body, str):
+        body = body.encode()
+    start = body.find(b"[")
+    flat = None if start < 0 else _scan_rows(body, start, 5)
+    if flat is not None:
+        return _split_rows(flat, 5)
+    return rows_to_arrays(loads(body), 5)
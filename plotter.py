@@ -1,18 +1,84 @@
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+import numpy as np
 import pandas as pd
 
-from processing import get_investments_by_coin
+from processing import PRICE_GRANULARITIES, get_investments_for_coins
+from downsampling import downsample
 
+# Puntos por serie que se mandan al navegador (~ancho en pixeles de un subplot).
+# None en max_points desactiva la reduccion.
+MAX_POINTS_PER_TRACE = 1000
+# A partir de cuantos puntos una serie se dibuja con WebGL (Scattergl) en vez de SVG
+WEBGL_THRESHOLD = 2000
 
-def plot_comparison_with_marker(df1: pd.DataFrame, df2: pd.DataFrame, name1: str, name2: str,
-                                 marker_date: str, investment_amount: float):
+
+def line_trace(df: pd.DataFrame, name: str, max_points: int = MAX_POINTS_PER_TRACE,
+               method: str = 'lttb', **kwargs):
+    """
+    Traza de linea date/price_usd reducida a max_points (LTTB o min/max) y en
+    WebGL si aun quedan mas de WEBGL_THRESHOLD puntos.
+    """
+    if max_points is not None:
+        df = downsample(df, max_points, method=method)
+    trace_cls = go.Scattergl if len(df) > WEBGL_THRESHOLD else go.Scatter
+    return trace_cls(x=df['date'], y=df['price_usd'], mode='lines', name=name, **kwargs)
+
+
+def investment_markers(coin_dataframes: dict) -> dict:
+    """
+    Marcadores de inversion de todas las monedas graficadas, con una sola
+    consulta a investments.
+
+    Cada inversion se ubica sobre el ultimo precio en o antes de su fecha
+    (busqueda binaria sobre las fechas ordenadas del DataFrame de la moneda),
+    asi no se pierden inversiones cuando el precio guardado tiene hora. Las
+    inversiones fuera del rango del DataFrame (antes del primer precio o despues
+    del ultimo, o del fin del ultimo intervalo si es un agregado de load_prices)
+    se omiten: el DataFrame puede ser solo la ventana visible.
+
+    Parámetros:
+        coin_dataframes: diccionario coin_id -> DataFrame con date, price_usd (sin reducir)
+
+    Retorna:
+        Diccionario coin_id -> {'x', 'y', 'amount', 'investor'} (arrays) solo de
+        monedas con inversiones ubicables.
+    """
+    frames = {coin.lower(): df for coin, df in coin_dataframes.items()}
+    investments = get_investments_for_coins(frames)
+    markers = {}
+    for coin, inv in investments.groupby('coin_id', sort=False):
+        df = frames.get(coin)
+        if df is None or df.empty:
+            continue
+        price_dates = df['date'].to_numpy()
+        inv_dates = inv['date'].to_numpy().astype(price_dates.dtype)
+        pos = np.searchsorted(price_dates, inv_dates, side='right') - 1
+        ok = pos >= 0  # inversiones anteriores al primer precio no tienen donde ubicarse
+        # Ni las posteriores al ultimo precio (o al fin del ultimo intervalo del agregado)
+        bucket_ms = PRICE_GRANULARITIES.get(df.attrs.get('granularity'))
+        if bucket_ms:
+            ok &= inv_dates < price_dates[-1] + np.timedelta64(bucket_ms, 'ms')
+        else:
+            ok &= inv_dates <= price_dates[-1]
+        if not ok.any():
+            continue
+        pos = pos[ok]
+        markers[coin] = {
+            'x': price_dates[pos],
+            'y': df['price_usd'].to_numpy()[pos],
+            'amount': inv['amount'].to_numpy()[ok],
+            'investor': inv['investor'].to_numpy()[ok],
+        }
+    return markers
+
+
+def build_comparison_with_marker(df1: pd.DataFrame, df2: pd.DataFrame, name1: str, name2: str,
+                                 marker_date: str, investment_amount: float,
+                                 max_points: int = MAX_POINTS_PER_TRACE) -> go.Figure:
     fig = make_subplots(rows=1, cols=2, subplot_titles=[f"{name1}", f"{name2}"])
 
-    fig.add_trace(
-        go.Scatter(x=df1['date'], y=df1['price_usd'], mode='lines', name=name1),
-        row=1, col=1
-    )
+    fig.add_trace(line_trace(df1, name1, max_points), row=1, col=1)
 
     #marker_row = df1[df1['date'] == marker_date]
     #if not marker_row.empty:
@@ -29,10 +95,7 @@ def plot_comparison_with_marker(df1: pd.DataFrame, df2: pd.DataFrame, name1: str
     #        row=1, col=1
     #    )
 
-    fig.add_trace(
-        go.Scatter(x=df2['date'], y=df2['price_usd'], mode='lines', name=name2),
-        row=1, col=2
-    )
+    fig.add_trace(line_trace(df2, name2, max_points), row=1, col=2)
 
     fig.update_layout(
         title_text=f"Comparación de precios: {name1} vs {name2} (con punto destacado)",
@@ -61,39 +124,170 @@ def plot_comparison_with_marker(df1: pd.DataFrame, df2: pd.DataFrame, name1: str
     fig.update_yaxes(title_text="Precio USD", row=1, col=1)
     fig.update_yaxes(title_text="Precio USD", row=1, col=2)
 
-    # ➕ Agregar inversiones sobre df1 (name1) correctamente alineadas a precio
-    investments1 = get_investments_by_coin(name1.lower())
-    if not investments1.empty:
-        merged1 = pd.merge(investments1, df1, on="date", how="inner")  # une con price_usd
+    # ➕ Agregar inversiones de ambas monedas (una consulta) sobre su precio as-of
+    markers = investment_markers({name1.lower(): df1, name2.lower(): df2})
+    styles = [(name1, dict(color='green', size=8, symbol='diamond'), 1),
+              (name2, dict(color='blue', size=8, symbol='triangle-up'), 2)]
+    for name, marker, col in styles:
+        m = markers.get(name.lower())
+        if m is None:
+            continue
         fig.add_trace(
             go.Scatter(
-                x=merged1['date'],
-                y=merged1['price_usd'],  # graficamos sobre el precio real
+                x=m['x'],
+                y=m['y'],  # graficamos sobre el precio real
                 mode='markers+text',
-                marker=dict(color='green', size=8, symbol='diamond'),
-                text=[f"${a:.2f}" for a in merged1['amount']],
+                marker=marker,
+                text=[f"${a:.2f}" for a in m['amount']],
                 textposition="bottom center",
-                name=f"Inversiones en {name1}"
+                name=f"Inversiones en {name}"
             ),
-            row=1, col=1
+            row=1, col=col
         )
 
-    # ➕ Repetir para df2
-    investments2 = get_investments_by_coin(name2.lower())
-    if not investments2.empty:
-        merged2 = pd.merge(investments2, df2, on="date", how="inner")
+    return fig
+
+
+def plot_comparison_with_marker(df1: pd.DataFrame, df2: pd.DataFrame, name1: str, name2: str,
+                                 marker_date: str, investment_amount: float):
+    fig = build_comparison_with_marker(df1, df2, name1, name2, marker_date, investment_amount)
+    fig.show()
+
+
+def build_price_grid(coin_dataframes: dict, cols: int = 2, max_points: int = MAX_POINTS_PER_TRACE,
+                     method: str = 'lttb') -> go.Figure:
+    """
+    Grafica de precios por moneda en subplots (2 columnas), con el ultimo precio
+    resaltado y las inversiones registradas sobre la linea de precio.
+
+    Parámetros:
+        coin_dataframes: diccionario coin_id -> DataFrame con date, price_usd
+        cols: columnas de la cuadricula
+        max_points: puntos por linea enviados al navegador (None = todos)
+        method: reduccion de puntos, 'lttb' o 'minmax'
+    """
+    coins = list(coin_dataframes)
+    rows = (len(coins) + cols - 1) // cols
+    fig = make_subplots(rows=rows, cols=cols, subplot_titles=[coin.capitalize() for coin in coins])
+    markers = investment_markers(coin_dataframes)
+
+    for idx, coin in enumerate(coins):
+        row = (idx // cols) + 1
+        col = (idx % cols) + 1
+        df = coin_dataframes[coin]
+
+        # Línea de precio (reducida a max_points; el ultimo punto siempre se conserva)
+        fig.add_trace(line_trace(df, coin, max_points, method), row=row, col=col)
+
+        # Ultimo punto con texto y color rojo  -  '%Y-%m-%d'
+        last_row = df.iloc[-1]
         fig.add_trace(
             go.Scatter(
-                x=merged2['date'],
-                y=merged2['price_usd'],
-                mode='markers+text',
-                marker=dict(color='blue', size=8, symbol='triangle-up'),
-                text=[f"${a:.2f}" for a in merged2['amount']],
-                textposition="bottom center",
-                name=f"Inversiones en {name2}"
+                x=[last_row['date']],
+                y=[last_row['price_usd']],
+                mode='markers',
+                marker=dict(size=8, color='red', symbol='circle'),
+                name=f"{coin} último"
             ),
-            row=1, col=2
+            row=row, col=col
         )
 
-    fig.show()
+        # Añadir texto con fondo rojo y letras blancas como anotación. En los
+        # agregados date es el inicio del intervalo: se rotula con la fecha del cierre
+        label_date = last_row['last_date'] if 'last_date' in df.columns else last_row['date']
+        fig.add_annotation(
+            x=last_row['date'],
+            y=last_row['price_usd'],
+            text=f"{label_date.strftime('%m-%d')}<br>${last_row['price_usd']:.2f}",
+            showarrow=True,
+            arrowhead=0,
+            ax=30,
+            ay=-30,
+            font=dict(color='white', size=9),
+            align='right',
+            bgcolor='red',
+            bordercolor='red',
+            borderwidth=1,
+            row=row,
+            col=col
+        )
+
+        # Inversiones alineadas (consultadas una sola vez para todas las monedas)
+        m = markers.get(coin.lower())
+        if m is not None:
+            fig.add_trace(
+                go.Scatter(
+                    x=m['x'],
+                    y=m['y'],
+                    mode='markers+text',
+                    marker=dict(size=10, color='black', symbol='hexagon'),
+                    text=[f"${a:.0f}" for a in m['amount']],
+                    textposition="bottom center",
+                    name=f"Inversiones en {coin}"
+                ),
+                row=row, col=col
+            )
+
+    # Layout
+    fig.update_layout(
+        title_text="Comparador múltiple de precios con puntos de inversión",
+        height=600 * rows,
+        width=1200,
+        showlegend=False,
+        hovermode="x unified"  # activa spike + tooltip combinado
+    )
+
+    # Estetica de ejes
+    for r in range(1, rows + 1):
+        for c in range(1, cols + 1):
+            fig.update_xaxes(
+                title_text="Fecha",
+                tickformat="%b\n%Y",
+                dtick="M1",
+                tickangle=-45,
+                tickfont=dict(size=9),
+                showspikes=True,  # activa línea vertical
+                spikemode="across",  # línea cruzando subplots
+                spikesnap="cursor",  # sigue el cursor
+                spikedash="dot",  # línea punteada
+                spikethickness=1,
+                spikecolor="gray",
+                row=r,
+                col=c
+            )
+            fig.update_yaxes(title_text="Precio USD", row=r, col=c)
+
+    return fig
+
+
+def build_roi_figure(df_result: pd.DataFrame) -> go.Figure:
+    """
+    Barras de ROI por inversion (DataFrame de processing.compute_positions).
+    """
+    fig = go.Figure(go.Bar(
+        x=df_result['coin_id'],
+        y=df_result['roi'],
+        text=[f"{r:.2%}" for r in df_result['roi']],
+        textposition="outside",
+    ))
+    fig.update_layout(title_text="ROI actual por moneda", yaxis_tickformat=".0%")
+    return fig
+
+
 
+def build_correlation_heatmap(corr, coin_ids: list) -> go.Figure:
+    """
+    Mapa de calor de la matriz de correlacion (analytics.correlation_matrix).
+    """
+    fig = go.Figure(go.Heatmap(
+        z=corr,
+        x=coin_ids,
+        y=coin_ids,
+        zmin=-1,
+        zmax=1,
+        colorscale="RdBu",
+        text=[[f"{v:.2f}" for v in row] for row in corr],
+        texttemplate="%{text}",
+    ))
+    fig.update_layout(title_text="Correlación de retornos diarios", height=500)
+    return fig
@@ -0,0 +1,277 @@
+# Valuacion diaria del portafolio (NAV, costo y ganancia por inversor)
+
+# Las unidades de cada par (inversor, moneda) salen de la suma acumulada de las
+# compras sobre el eje de fechas de la matriz de precios alineada
+# (processing.get_price_matrix); el valor es unidades x precio y se agrega por
+# inversor con un producto de matrices. No hay ciclos por dia.
+#
+# PortfolioEngine guarda las series calculadas: al agregar o eliminar una
+# inversion solo se suma su delta desde su fecha, y al llegar un dia nuevo de
+# precios solo se valuan las filas nuevas (y las filas cuyo precio cambio).
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+from db import series_to_epoch_ms
+from processing import PRICE_MATRIX_FREQ_MS, asof_prices, get_all_investments, get_price_matrix
+
+
+class PortfolioEngine:
+    """
+    Motor de valuacion con estado. refresh() sincroniza con la tabla investments
+    y con la matriz de precios, recalculando solo lo que cambio.
+
+    Uso:
+        engine = PortfolioEngine()
+        por_inversor, total, errores = engine.refresh()
+    """
+
+    def __init__(self, freq: str = '1d'):
+        self.freq = freq
+        self.freq_ms = PRICE_MATRIX_FREQ_MS[freq]
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.coins = []
+        self.investors = []
+        self.pairs = []                                 # (investor, coin_id) por columna de units
+        self.dates = np.empty(0, dtype=np.int64)        # inicio de cada intervalo (epoch ms)
+        self.prices = np.empty((0, 0))                  # (fechas, monedas), con forward fill
+        self.units = np.empty((0, 0))                   # unidades acumuladas (fechas, pares)
+        self.nav = np.empty((0, 0))                     # valor por inversor (fechas, inversores)
+        self.cost = np.empty((0, 0))                    # costo acumulado por inversor
+        self.positions = {}                             # (coin_id, date_ms, investor) -> (amount, units)
+        self.errors = {}                                # misma clave -> mensaje
+
+    # ---------------------------
+    # Indices de columnas
+    # ---------------------------
+    def _pair_index(self, investor: str, coin_id: str) -> int:
+        if (investor, coin_id) not in self.pairs:
+            self.pairs.append((investor, coin_id))
+            self.units = np.hstack([self.units, np.zeros((len(self.dates), 1))])
+        if investor not in self.investors:
+            self.investors.append(investor)
+            self.nav = np.hstack([self.nav, np.zeros((len(self.dates), 1))])
+            self.cost = np.hstack([self.cost, np.zeros((len(self.dates), 1))])
+        return self.pairs.index((investor, coin_id))
+
+    def _pair_prices(self, rows: slice) -> np.ndarray:
+        # Precio de la moneda de cada par (0 antes del primer precio, donde no hay unidades)
+        coin_cols = [self.coins.index(coin) for _, coin in self.pairs]
+        return np.nan_to_num(self.prices[rows][:, coin_cols])
+
+    def _investor_matrix(self) -> np.ndarray:
+        # (pares, inversores) con un 1 en el inversor de cada par
+        g = np.zeros((len(self.pairs), len(self.investors)))
+        g[np.arange(len(self.pairs)), [self.investors.index(inv) for inv, _ in self.pairs]] = 1.0
+        return g
+
+    def _revalue(self, start: int):
+        # Recalcula el valor por inversor desde la fila start
+        if len(self.pairs):
+            self.nav[start:] = (self.units[start:] * self._pair_prices(slice(start, None))) @ self._investor_matrix()
+
+    # ---------------------------
+    # Flujos (compras / bajas)
+    # ---------------------------
+    def _apply(self, keys: list, sign: float):
+        """
+        Suma (sign=1) o resta (sign=-1) las posiciones indicadas a partir de su
+        fecha: flujos por fila, suma acumulada y valuacion solo del tramo afectado.
+        """
+        keys = [k for k in keys if k in self.positions]
+        if not keys or not len(self.dates):
+            return
+        buckets = np.array([date_ms - date_ms % self.freq_ms for _, date_ms, _ in keys], dtype=np.int64)
+        rows = np.searchsorted(self.dates, buckets, side='left')
+        start = int(rows.min())
+        if start >= len(self.dates):
+            return  # todas posteriores al ultimo precio; se aplican al extender
+
+        pair_idx = np.array([self._pair_index(investor, coin) for coin, _, investor in keys])
+        inv_idx = np.array([self.investors.index(investor) for _, _, investor in keys])
+        amounts = np.array([self.positions[k][0] for k in keys]) * sign
+        units = np.array([self.positions[k][1] for k in keys]) * sign
+
+        n = len(self.dates) - start
+        unit_flows = np.zeros((n + 1, len(self.pairs)))
+        cost_flows = np.zeros((n + 1, len(self.investors)))
+        np.add.at(unit_flows, (rows - start, pair_idx), units)
+        np.add.at(cost_flows, (rows - start, inv_idx), amounts)
+        unit_delta = np.cumsum(unit_flows[:n], axis=0)
+
+        self.units[start:] += unit_delta
+        self.cost[start:] += np.cumsum(cost_flows[:n], axis=0)
+        self.nav[start:] += (unit_delta * self._pair_prices(slice(start, None))) @ self._investor_matrix()
+
+    def _add_positions(self, df: pd.DataFrame):
+        # Precio de compra: ultimo precio en o antes de la fecha (como compute_positions)
+        buy_prices = asof_prices(df['coin_id'], df['date'])
+        added = []
+        for row, price in zip(df.itertuples(index=False), buy_prices):
+            key = (row.coin_id, row.date, row.investor)
+            if np.isnan(price):
+                self.errors[key] = "No hay precio anterior a la fecha de inversión"
+                continue
+            self.positions[key] = (row.amount, row.amount / price)
+            self._pair_index(row.investor, row.coin_id)
+            added.append(key)
+        self._apply(added, 1.0)
+
+    # ---------------------------
+    # Sincronizacion
+    # ---------------------------
+    def _sync_prices(self, coins: list) -> list:
+        """
+        Trae la matriz de precios y ajusta las series guardadas. Retorna las
+        posiciones que deben (re)aplicarse porque su fecha cae en filas nuevas.
+        """
+        requested = self.coins + [c for c in coins if c not in self.coins]
+        dates, prices = get_price_matrix(requested, freq=self.freq)
+        dates = dates.to_numpy().astype('datetime64[ms]').astype(np.int64)
+        old_n = len(self.dates)
+
+        if old_n and (len(dates) < old_n or not np.array_equal(dates[:old_n], self.dates)):
+            # El eje de fechas cambio por delante (historico extendido hacia atras):
+            # se reconstruye todo con las unidades ya conocidas de cada posicion
+            positions, errors = self.positions, self.errors
+            self._reset()
+            self.positions, self.errors = positions, errors
+            old_n = 0
+
+        self.coins = requested
+        old_prices = self.prices
+        self.dates, self.prices = dates, prices
+
+        # Filas nuevas: se arrastran unidades y costo del ultimo dia y se valuan solo esas filas
+        extra = len(dates) - old_n
+        if extra:
+            last_units = self.units[-1:] if old_n else np.zeros((1, len(self.pairs)))
+            last_cost = self.cost[-1:] if old_n else np.zeros((1, len(self.investors)))
+            self.units = np.vstack([self.units, np.repeat(last_units, extra, axis=0)])
+            self.cost = np.vstack([self.cost, np.repeat(last_cost, extra, axis=0)])
+            self.nav = np.vstack([self.nav, np.zeros((extra, len(self.investors)))])
+            self._revalue(old_n)
+
+        # Precios revisados en filas ya valuadas: se revalua desde el primer cambio
+        if old_n and old_prices.size:
+            old_cols = old_prices.shape[1]
+            changed = ~np.isclose(self.prices[:old_n, :old_cols], old_prices, equal_nan=True).all(axis=1)
+            if changed.any():
+                self._revalue(int(changed.argmax()))
+
+        # Posiciones con fecha posterior al ultimo precio anterior: entran con las filas nuevas
+        if not extra:
+            return []
+        if not old_n:
+            return list(self.positions)
+        last_ms = self.dates[old_n - 1]
+        return [k for k in self.positions if k[1] - k[1] % self.freq_ms > last_ms]
+
+    def refresh(self, df_invest: pd.DataFrame = None) -> tuple:
+        """
+        Sincroniza con las inversiones y precios actuales y retorna las series.
+
+        Parámetros:
+            df_invest: DataFrame con coin_id, date, investor, amount (por defecto todas)
+
+        Retorna:
+            (por_inversor, total, errores): ver result()
+        """
+        if df_invest is None:
+            df_invest = get_all_investments()
+        inv = pd.DataFrame({
+            'coin_id': df_invest['coin_id'].astype(str).str.lower().to_numpy(),
+            'date': series_to_epoch_ms(df_invest['date']).to_numpy(),
+            'investor': df_invest['investor'].astype(str).to_numpy(),
+            'amount': df_invest['amount'].astype(float).to_numpy(),
+        }).dropna(subset=['date'])
+        inv['date'] = inv['date'].astype('int64')
+        inv = inv.drop_duplicates(subset=['coin_id', 'date', 'investor'], keep='last')
+
+        with self._lock:
+            pending = self._sync_prices(list(dict.fromkeys(inv['coin_id'])))
+            self._apply(pending, 1.0)
+
+            # Diferencia contra la tabla: bajas (o montos cambiados) y altas
+            current = {(r.coin_id, r.date, r.investor): r.amount for r in inv.itertuples(index=False)}
+            removed = [k for k, (amount, _) in self.positions.items() if current.get(k) != amount]
+            self._apply(removed, -1.0)
+            for k in removed:
+                del self.positions[k]
+            # Las inversiones sin precio de compra se reintentan (pudo llegar historico)
+            self.errors = {}
+            new_keys = [k for k in current if k not in self.positions]
+            if new_keys:
+                new_rows = inv.set_index(['coin_id', 'date', 'investor']).loc[new_keys].reset_index()
+                self._add_positions(new_rows)
+            return self.result()
+
+    def result(self) -> tuple:
+        """
+        Retorna:
+            (por_inversor, total, errores):
+            - por_inversor: date, investor, valor, costo, ganancia, roi (desde la primera inversion)
+            - total: mismas columnas sin investor, sumando todos los inversores
+            - errores: coin_id, fecha_inversion, error de las inversiones sin precio de compra
+        """
+        errores = pd.DataFrame(
+            [(coin, pd.to_datetime(date_ms, unit='ms').date(), error) for (coin, date_ms, _), error in self.errors.items()],
+            columns=['coin_id', 'fecha_inversion', 'error']
+        )
+        columns = ['date', 'valor', 'costo', 'ganancia', 'roi']
+        if not self.positions or not len(self.dates):
+            return pd.DataFrame(columns=columns[:1] + ['investor'] + columns[1:]), pd.DataFrame(columns=columns), errores
+
+        first_ms = min(k[1] for k in self.positions)
+        start = int(np.searchsorted(self.dates, first_ms - first_ms % self.freq_ms, side='left'))
+        dates = pd.to_datetime(self.dates[start:], unit='ms')
+        nav, cost = self.nav[start:], self.cost[start:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            por_inversor = pd.DataFrame({
+                'date': np.repeat(dates, len(self.investors)),
+                'investor': np.tile(self.investors, len(dates)),
+                'valor': nav.ravel(),
+                'costo': cost.ravel(),
+                'ganancia': (nav - cost).ravel(),
+                'roi': np.where(cost > 0, (nav - cost) / cost, np.nan).ravel(),
+            })
+            nav_total, cost_total = nav.sum(axis=1), cost.sum(axis=1)
+            total = pd.DataFrame({
+                'date': dates,
+                'valor': nav_total,
+                'costo': cost_total,
+                'ganancia': nav_total - cost_total,
+                'roi': np.where(cost_total > 0, (nav_total - cost_total) / cost_total, np.nan),
+            })
+        # Inversores que aun no tienen posiciones en esas fechas quedan con costo 0
+        por_inversor = por_inversor[por_inversor['costo'] > 0].reset_index(drop=True)
+        return por_inversor, total, errores
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_portfolio_engine() -> PortfolioEngine:
+    """
+    Motor compartido por el proceso (en Streamlit, por todas las sesiones).
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PortfolioEngine()
+    return _engine
+
+
+def portfolio_history(df_invest: pd.DataFrame = None) -> tuple:
+    """
+    Series diarias de valor, costo y ganancia por inversor y del total,
+    actualizadas de forma incremental con el motor compartido.
+    """
+    return get_portfolio_engine().refresh(df_invest)
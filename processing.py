@@ -1,81 +1,565 @@
 # Se crea en automatico la DB
 
+import numpy as np
 import pandas as pd
 import sqlite3
 import os
-from api import fetch_market_chart
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from api import fetch_market_chart, fetch_market_chart_range, fetch_ohlc_with_volume, ohlc_granularity, OHLC_VALID_DAYS, OHLC_GRANULARITY_MS
+from db import get_connection, transaction, to_epoch_ms, series_to_epoch_ms, from_epoch_ms
+from migrations import migrate
+from cache import cached, invalidate
+import columnar
+from rollups import ROLLUPS, DAY_MS, WEEK_MS, bucket_start, refresh_rollups
+from payloads import rows_to_arrays
 
 from datetime import datetime, timedelta
 
-DB_PATH = "data/crypto.db"
+# Watchlist de monedas del dashboard (tambien la usan la CLI y el refresco programado)
+AVAILABLE_COINS = ["algorand", "solana", "bitcoin", "cardano", "dogecoin", "avalanche-2", "polkadot", "chainlink", "arbitrum", "aave"]
+
+# Limite global de descargas simultaneas (compartido por todas las sesiones del proceso)
+MAX_CONCURRENT_FETCHES = int(os.environ.get("CRYPTOAI_MAX_CONCURRENT_FETCHES", 4))
+_fetch_semaphore = threading.BoundedSemaphore(MAX_CONCURRENT_FETCHES)
+# Hilos que ya tienen un lugar del semaforo (ej. una moneda que descarga su backfill)
+_fetch_holder = threading.local()
+
+
+@contextmanager
+def _fetch_permit():
+    """
+    Toma un lugar de _fetch_semaphore, salvo que el hilo ya tenga uno: las
+    descargas anidadas (backfill dentro de get_historical_price_dataframes) no
+    deben esperar un segundo lugar mientras retienen el primero.
+    """
+    if getattr(_fetch_holder, 'held', False):
+        yield
+        return
+    with _fetch_semaphore:
+        _fetch_holder.held = True
+        try:
+            yield
+        finally:
+            _fetch_holder.held = False
+
+
+def _holds_fetch_permit() -> bool:
+    return getattr(_fetch_holder, 'held', False)
+
+# TTL del cache de lecturas. Las escrituras de este modulo invalidan las claves
+# afectadas; el TTL solo cubre escrituras de otros procesos (ej. CLI o cron).
+PRICES_CACHE_TTL = 60 * 60
+INVESTMENTS_CACHE_TTL = 5 * 60
+
+
+def _coin_tag(arguments: dict) -> str:
+    return arguments['coin_id'].lower()
 
 def create_db():
-    os.makedirs("data", exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS prices (
-            coin_id TEXT,
-            date TEXT,
-            price_usd REAL,
-            PRIMARY KEY (coin_id, date)
-        )
-    """)
-
-    # Crear tabla de inversiones
-    cursor.execute("""
-           CREATE TABLE IF NOT EXISTS investments (
-               coin_id TEXT,
-               date TEXT,
-               investor TEXT,
-               amount REAL,
-               note TEXT,
-               PRIMARY KEY (coin_id, date, investor)
-           )
-       """)
-    conn.commit()
-    conn.close()
-
-def save_to_db(df: pd.DataFrame, coin_id: str):
-    #conn = sqlite3.connect(DB_PATH)
-    #df_copy = df.copy()
-    #df_copy['coin_id'] = coin_id
-    #df_copy[['coin_id', 'date', 'price_usd']].to_sql("prices", conn, if_exists="append", index=False)
-    #conn.close()
-    conn = sqlite3.connect(DB_PATH)
-    df_copy = df.copy()
-    df_copy['coin_id'] = coin_id
-
-    # Obtener fechas existentes
-    existing = pd.read_sql_query(
-        "SELECT date FROM prices WHERE coin_id = ?", conn, params=(coin_id,)
+    # Crea las tablas o actualiza el esquema de una base existente (ver migrations.py)
+    migrate()
+
+def get_last_price_timestamp(coin_id: str, conn: sqlite3.Connection = None):
+    """
+    Ultimo timestamp (epoch ms) guardado para la moneda, o None si no hay datos.
+    Usa la PK (coin_id, date): no recorre el historico.
+    """
+    conn = conn or get_connection()
+    row = conn.execute("SELECT MAX(date) FROM prices WHERE coin_id = ?", (coin_id.lower(),)).fetchone()
+    return row[0]
+
+
+def save_to_db(df: pd.DataFrame, coin_id: str, incremental: bool = True) -> dict:
+    """
+    Upsert masivo de precios (INSERT ... ON CONFLICT DO UPDATE) en una transaccion.
+
+    Parámetros:
+        df: DataFrame con columnas date, price_usd
+        coin_id: ID de la criptomoneda
+        incremental: si es True solo se escriben filas con fecha >= al ultimo
+            timestamp guardado (el delta); con False se escribe todo el DataFrame
+
+    Retorna:
+        Diccionario con el numero de filas insertadas y actualizadas
+        (las filas con el mismo precio no cuentan como actualizadas).
+    """
+    coin_id = coin_id.lower()
+    rows = pd.DataFrame({
+        'date': series_to_epoch_ms(df['date'].reset_index(drop=True)),
+        'price_usd': df['price_usd'].reset_index(drop=True).astype(float),
+    }).dropna(subset=['date'])
+
+    with transaction() as conn:
+        if incremental:
+            last_ms = get_last_price_timestamp(coin_id, conn)
+            if last_ms is not None:
+                rows = rows[rows['date'] >= last_ms]
+        rows = rows.drop_duplicates(subset=['date'], keep='last')
+        if rows.empty:
+            return {"insertados": 0, "actualizados": 0}
+
+        # Solo se consultan las claves existentes dentro del rango del delta
+        existing_dates = {r[0] for r in conn.execute(
+            "SELECT date FROM prices WHERE coin_id = ? AND date BETWEEN ? AND ?",
+            (coin_id, int(rows['date'].min()), int(rows['date'].max()))
+        )}
+        existing = int(rows['date'].isin(existing_dates).sum())
+
+        changes_before = conn.total_changes
+        conn.executemany("""
+            INSERT INTO prices (coin_id, date, price_usd) VALUES (?, ?, ?)
+            ON CONFLICT (coin_id, date) DO UPDATE SET price_usd = excluded.price_usd
+            WHERE price_usd IS NOT excluded.price_usd
+        """, zip([coin_id] * len(rows), rows['date'].astype(int).tolist(), rows['price_usd'].tolist()))
+        changes = conn.total_changes - changes_before
+        if changes:
+            # Agregados diarios/semanales desde el primer intervalo tocado, en la misma transaccion
+            refresh_rollups(conn, coin_id, int(rows['date'].min()))
+
+    if changes:
+        invalidate('prices', coin_id)
+        _mark_price_matrix_dirty(coin_id, int(rows['date'].min()))
+        if columnar.is_enabled():
+            columnar.sync_coin(coin_id, since_ms=int(rows['date'].min()))
+    insertados = len(rows) - existing
+    return {"insertados": insertados, "actualizados": changes - insertados}
+
+PRICE_COLUMNS = ['date', 'price_usd']
+
+
+def _read_prices(coin_id: str, start=None, end=None, columns: list = None) -> pd.DataFrame:
+    """
+    Consulta por rango sobre la PK (coin_id, date): solo se leen las filas y
+    columnas pedidas. start/end son inclusivos y aceptan str, datetime o epoch ms.
+    Con la copia columnar activa y al dia se lee del archivo Arrow de la moneda.
+    """
+    columns = list(columns or PRICE_COLUMNS)
+    unknown = set(columns) - set(PRICE_COLUMNS)
+    if unknown:
+        raise ValueError(f"Columnas no validas: {sorted(unknown)}")
+    if columnar.is_enabled():
+        # Copia Arrow con memory-map, solo si cubre lo mismo que SQLite (otro
+        # proceso sin la copia activa pudo escribir precios despues)
+        coin = coin_id.lower()
+        bounds = _price_bounds([coin]).get(coin)
+        if bounds is not None and columnar.file_bounds(coin) == tuple(bounds):
+            return columnar.load_prices_columnar(coin, start, end, columns)
+
+    conditions, params = ["coin_id = ?"], [coin_id.lower()]
+    if start is not None:
+        conditions.append("date >= ?")
+        params.append(to_epoch_ms(start))
+    if end is not None:
+        conditions.append("date <= ?")
+        params.append(to_epoch_ms(end))
+    query = f"SELECT {', '.join(columns)} FROM prices WHERE {' AND '.join(conditions)} ORDER BY date"
+    df = pd.read_sql_query(query, get_connection(), params=params)
+    if 'date' in df.columns:
+        df['date'] = from_epoch_ms(df['date'])
+    return df
+
+
+@cached('prices', ttl=PRICES_CACHE_TTL, tag=_coin_tag)
+def load_from_db(coin_id: str, start=None, end=None, columns: list = None) -> pd.DataFrame:
+    """
+    Precios guardados de una moneda, opcionalmente acotados a [start, end] y a
+    un subconjunto de columnas ('date', 'price_usd'). Retorna None si no hay filas.
+    """
+    df = _read_prices(coin_id, start, end, columns)
+    if df.empty:
+        return None
+    return df
+
+
+# Granularidades de lectura, de la mas fina a la mas gruesa
+PRICE_GRANULARITIES = {'raw': None, '1d': DAY_MS, '1w': WEEK_MS}
+# Puntos minimos que debe tener una lectura 'auto' en el rango pedido
+MIN_CHART_POINTS = 200
+
+
+def choose_price_granularity(start_ms: int, end_ms: int, min_points: int = MIN_CHART_POINTS) -> str:
+    """
+    La granularidad mas gruesa que aun da min_points puntos en [start_ms, end_ms];
+    'raw' si ni la diaria alcanza.
+    """
+    span = max(end_ms - start_ms, 0)
+    for granularity in ('1w', '1d'):
+        if span // PRICE_GRANULARITIES[granularity] >= min_points:
+            return granularity
+    return 'raw'
+
+
+def load_rollup(coin_id: str, granularity: str, start=None, end=None) -> pd.DataFrame:
+    """
+    Agregados OHLC de una moneda ('1d' o '1w') de los intervalos que se cruzan
+    con [start, end] (incluye el intervalo que contiene start).
+
+    Retorna:
+        DataFrame con date (inicio del intervalo), open, high, low, close, samples
+        y last_date (fecha del ultimo punto del intervalo).
+    """
+    if granularity not in ROLLUPS:
+        raise ValueError(f"Granularidad no valida: {granularity}. Usa una de {list(ROLLUPS)}")
+    table = ROLLUPS[granularity][0]
+    conditions, params = ["coin_id = ?"], [coin_id.lower()]
+    if start is not None:
+        conditions.append("bucket >= ?")
+        params.append(bucket_start(to_epoch_ms(start), granularity))
+    if end is not None:
+        conditions.append("bucket <= ?")
+        params.append(to_epoch_ms(end))
+    df = pd.read_sql_query(
+        f"SELECT bucket AS date, open, high, low, close, samples, last_ts AS last_date FROM {table} "
+        f"WHERE {' AND '.join(conditions)} ORDER BY bucket",
+        get_connection(), params=params
     )
-    existing_dates = set(existing['date'])
+    df['date'] = from_epoch_ms(df['date'])
+    df['last_date'] = from_epoch_ms(df['last_date'])
+    return df
 
-    # Filtrar solo fechas nuevas
-    df_copy = df_copy[~df_copy['date'].astype(str).isin(existing_dates)]
 
-    # Insertar solo lo nuevo
-    df_copy[['coin_id', 'date', 'price_usd']].to_sql("prices", conn, if_exists="append", index=False)
-    conn.close()
+@cached('prices', ttl=PRICES_CACHE_TTL, tag=_coin_tag)
+def load_prices(coin_id: str, start=None, end=None, granularity: str = 'auto',
+                min_points: int = MIN_CHART_POINTS) -> pd.DataFrame:
+    """
+    Precios de una moneda con densidad pareja para graficar.
+
+    Con granularity='auto' se usa la tabla mas gruesa (semanal, diaria o los
+    puntos crudos de prices) que todavia da min_points puntos en el rango.
+
+    Retorna:
+        DataFrame con date, price_usd (cierre del intervalo en los agregados, que
+        traen ademas last_date: fecha de ese cierre) y la granularidad usada en
+        df.attrs['granularity']; None si no hay filas.
+    """
+    if granularity not in ('auto', *PRICE_GRANULARITIES):
+        raise ValueError(f"Granularidad no valida: {granularity}")
+    if granularity == 'auto':
+        bounds = _price_bounds([coin_id.lower()]).get(coin_id.lower())
+        if bounds is None:
+            return None
+        start_ms = bounds[0] if start is None else max(to_epoch_ms(start), bounds[0])
+        end_ms = bounds[1] if end is None else min(to_epoch_ms(end), bounds[1])
+        granularity = choose_price_granularity(start_ms, end_ms, min_points)
 
-def load_from_db(coin_id: str) -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH)
-    query = f"SELECT date, price_usd FROM prices WHERE coin_id = ?"
-    df = pd.read_sql_query(query, conn, params=(coin_id,))
-    conn.close()
+    if granularity == 'raw':
+        df = _read_prices(coin_id, start, end)
+    else:
+        df = load_rollup(coin_id, granularity, start, end)[['date', 'close', 'last_date']]
+        df = df.rename(columns={'close': 'price_usd'})
     if df.empty:
         return None
-    df['date'] = pd.to_datetime(df['date'])
+    df.attrs['granularity'] = granularity
+    return df
+
+
+def latest_price(coin_ids: list) -> pd.DataFrame:
+    """
+    Ultimo precio guardado de varias monedas (una busqueda por indice por moneda).
+
+    Retorna:
+        DataFrame con columnas coin_id, date (datetime), price_usd; solo monedas con datos.
+    """
+    coin_ids = list(dict.fromkeys(c.lower() for c in coin_ids))
+    if not coin_ids:
+        return pd.DataFrame(columns=['coin_id', 'date', 'price_usd'])
+    query = " UNION ALL ".join(
+        "SELECT * FROM (SELECT coin_id, date, price_usd FROM prices WHERE coin_id = ? ORDER BY date DESC LIMIT 1)"
+        for _ in coin_ids
+    )
+    df = pd.read_sql_query(query, get_connection(), params=coin_ids)
+    df['date'] = from_epoch_ms(df['date'])
     return df
 
+
+# Limite de parametros por consulta de SQLite (3 por fila en asof_prices)
+_ASOF_CHUNK = 5000
+
+
+def asof_prices(coin_ids, dates_ms) -> np.ndarray:
+    """
+    Precio en o antes de cada fecha (join as-of) resuelto en SQLite con una
+    busqueda por indice por fila, sin leer el historico.
+
+    Parámetros:
+        coin_ids: secuencia de IDs de moneda
+        dates_ms: secuencia de fechas en epoch ms (misma longitud)
+
+    Retorna:
+        Array float64 con el precio de cada fila (NaN si no hay precio previo).
+    """
+    rows = [(i, c.lower(), int(d)) for i, (c, d) in enumerate(zip(coin_ids, dates_ms))]
+    result = np.full(len(rows), np.nan)
+    conn = get_connection()
+    for offset in range(0, len(rows), _ASOF_CHUNK):
+        chunk = rows[offset:offset + _ASOF_CHUNK]
+        values = ", ".join("(?, ?, ?)" for _ in chunk)
+        query = f"""
+            WITH inv(idx, coin_id, date) AS (VALUES {values})
+            SELECT idx, (
+                SELECT price_usd FROM prices p
+                WHERE p.coin_id = inv.coin_id AND p.date <= inv.date
+                ORDER BY p.date DESC LIMIT 1
+            )
+            FROM inv
+        """
+        for idx, price in conn.execute(query, [v for row in chunk for v in row]):
+            if price is not None:
+                result[idx] = price
+    return result
+
+# ======================
+# Matriz de precios alineada (varias monedas)
+# ======================
+
+# Granularidades de la matriz: cada fecha es el inicio del intervalo y el valor
+# es el ultimo precio guardado dentro de el
+PRICE_MATRIX_FREQ_MS = {'1h': 60 * 60 * 1000, '1d': 24 * 60 * 60 * 1000}
+
+
+class _AlignedPrices:
+    # Estado cacheado de la matriz de una granularidad: columnas por moneda,
+    # filas por intervalo (epoch ms) y los limites de cada moneda ya leidos
+    def __init__(self):
+        self.coins = []
+        self.dates = np.empty(0, dtype=np.int64)
+        self.values = np.empty((0, 0))
+        self.bounds = {}  # coin_id -> (min_ms, max_ms) guardados al leer
+        self.dirty = {}   # coin_id -> primera fecha (epoch ms) escrita desde la ultima lectura
+        self.built_at = time.monotonic()
+
+    def column(self, coin_id: str) -> int:
+        if coin_id not in self.coins:
+            self.coins.append(coin_id)
+            self.values = np.hstack([self.values, np.full((len(self.dates), 1), np.nan)])
+        return self.coins.index(coin_id)
+
+    def merge(self, coin_id: str, since_ms, dates: np.ndarray, prices: np.ndarray):
+        col = self.column(coin_id)
+        new_dates = np.setdiff1d(dates, self.dates, assume_unique=True)
+        if len(new_dates):
+            all_dates = np.union1d(self.dates, new_dates)
+            values = np.full((len(all_dates), len(self.coins)), np.nan)
+            values[np.searchsorted(all_dates, self.dates)] = self.values
+            self.dates, self.values = all_dates, values
+        start = 0 if since_ms is None else int(np.searchsorted(self.dates, since_ms, side='left'))
+        self.values[start:, col] = np.nan
+        self.values[np.searchsorted(self.dates, dates), col] = prices
+
+
+_price_matrices = {}
+_price_matrix_lock = threading.Lock()
+
+
+def _mark_price_matrix_dirty(coin_id: str, since_ms: int):
+    # Cada granularidad guarda su propia marca: leer una no limpia la de las demas
+    with _price_matrix_lock:
+        for state in _price_matrices.values():
+            current = state.dirty.get(coin_id)
+            state.dirty[coin_id] = since_ms if current is None else min(current, since_ms)
+
+
+def _price_bounds(coin_ids: list) -> dict:
+    # MIN/MAX por moneda con una busqueda por indice cada uno
+    if not coin_ids:
+        return {}
+    query = " UNION ALL ".join(
+        "SELECT ?, (SELECT MIN(date) FROM prices WHERE coin_id = ?), (SELECT MAX(date) FROM prices WHERE coin_id = ?)"
+        for _ in coin_ids
+    )
+    params = [c for coin in coin_ids for c in (coin, coin, coin)]
+    return {coin: (lo, hi) for coin, lo, hi in get_connection().execute(query, params) if hi is not None}
+
+
+def get_price_bounds(coin_ids: list) -> dict:
+    """
+    Primera y ultima fecha guardada de cada moneda, sin leer sus precios.
+
+    Retorna:
+        {coin_id: (inicio, fin)} como Timestamps; las monedas sin datos se omiten.
+    """
+    create_db()
+    return {coin: (from_epoch_ms(lo), from_epoch_ms(hi)) for coin, (lo, hi) in _price_bounds(coin_ids).items()}
+
+
+def _read_price_buckets(ranges: dict, freq_ms: int) -> dict:
+    # Ultimo precio por intervalo de las monedas pedidas, en una sola consulta.
+    # Los intervalos diarios salen del agregado prices_daily; los demas de prices,
+    # donde SQLite toma price_usd de la fila con MAX(date) de cada grupo.
+    coins = list(ranges)
+    if freq_ms == DAY_MS:
+        query = " UNION ALL ".join(
+            "SELECT coin_id, bucket, close, last_ts FROM prices_daily WHERE coin_id = ? AND bucket >= ?"
+            for _ in coins
+        )
+        params = [v for coin in coins for v in (coin, ranges[coin] or 0)]
+    else:
+        query = " UNION ALL ".join(
+            "SELECT * FROM (SELECT coin_id, (date / ?) * ?, price_usd, MAX(date) FROM prices "
+            "WHERE coin_id = ? AND date >= ? GROUP BY date / ?)"
+            for _ in coins
+        )
+        params = [v for coin in coins for v in (freq_ms, freq_ms, coin, ranges[coin] or 0, freq_ms)]
+    rows = get_connection().execute(query, params).fetchall()
+    result = {coin: ([], []) for coin in coins}
+    for coin, bucket, price, _ in rows:
+        result[coin][0].append(bucket)
+        result[coin][1].append(price)
+    return {coin: (np.array(d, dtype=np.int64), np.array(p, dtype=float)) for coin, (d, p) in result.items()}
+
+
+def _sync_price_matrix(coin_ids: list, freq: str) -> _AlignedPrices:
+    freq_ms = PRICE_MATRIX_FREQ_MS[freq]
+    state = _price_matrices.get(freq)
+    if state is None or time.monotonic() - state.built_at > PRICES_CACHE_TTL:
+        # El TTL cubre escrituras de otros procesos sobre fechas ya leidas
+        state = _price_matrices[freq] = _AlignedPrices()
+
+    bounds = _price_bounds(coin_ids)
+    ranges = {}
+    for coin, (lo, hi) in bounds.items():
+        cached_bounds = state.bounds.get(coin)
+        dirty_ms = state.dirty.get(coin)
+        if cached_bounds is None or lo < cached_bounds[0]:
+            ranges[coin] = None  # moneda nueva o historico extendido hacia atras
+        elif dirty_ms is not None or hi > cached_bounds[1]:
+            since = min(cached_bounds[1], dirty_ms if dirty_ms is not None else cached_bounds[1])
+            ranges[coin] = since - since % freq_ms
+    if ranges:
+        for coin, (dates, prices) in _read_price_buckets(ranges, freq_ms).items():
+            state.merge(coin, ranges[coin], dates, prices)
+            state.bounds[coin] = bounds[coin]
+    for coin in bounds:
+        state.dirty.pop(coin, None)
+    return state
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    # Forward fill por columna: indice de la ultima fila valida hasta cada fila
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return values[idx, np.arange(values.shape[1])]
+
+
+def get_price_matrix(coin_ids: list, start=None, end=None, freq: str = '1d', fill: bool = True) -> tuple:
+    """
+    Precios de varias monedas alineados en una sola matriz (una columna por moneda).
+
+    La alineacion se hace en SQLite (ultimo precio por intervalo) y se guarda en
+    memoria: en llamadas siguientes solo se releen las monedas nuevas y la cola
+    de las monedas con precios escritos desde la ultima lectura, sin merges por moneda.
+
+    Parámetros:
+        coin_ids: lista de IDs de criptomonedas (orden de las columnas)
+        start, end: limites de fecha inclusivos (str, datetime o epoch ms), opcionales
+        freq: granularidad de las filas, una de PRICE_MATRIX_FREQ_MS
+        fill: si es True se arrastra el ultimo precio conocido sobre los huecos
+            (antes del primer precio de cada moneda queda NaN)
+
+    Retorna:
+        (dates, values): DatetimeIndex con el inicio de cada intervalo y array
+        float64 de forma (len(dates), len(coin_ids)); NaN donde no hay precio.
+    """
+    if freq not in PRICE_MATRIX_FREQ_MS:
+        raise ValueError(f"Granularidad no valida: {freq}. Usa una de {list(PRICE_MATRIX_FREQ_MS)}")
+    create_db()
+    coin_ids = [c.lower() for c in coin_ids]
+    with _price_matrix_lock:
+        state = _sync_price_matrix(list(dict.fromkeys(coin_ids)), freq)
+        cols = [state.coins.index(c) if c in state.coins else -1 for c in coin_ids]
+        # Indexado avanzado: copia propia, el estado cacheado no se expone
+        values = state.values[:, [max(c, 0) for c in cols]] if state.coins else np.full((len(state.dates), len(cols)), np.nan)
+        dates = state.dates.copy()
+
+    values[:, [i for i, c in enumerate(cols) if c < 0]] = np.nan
+    if fill and values.size:
+        # Antes de recortar, para arrastrar tambien precios anteriores a start
+        values = _ffill(values)
+    lo = 0 if start is None else int(np.searchsorted(dates, to_epoch_ms(start), side='left'))
+    hi = len(dates) if end is None else int(np.searchsorted(dates, to_epoch_ms(end), side='right'))
+    return pd.DatetimeIndex(from_epoch_ms(dates[lo:hi])), values[lo:hi]
+
+
 def process_price_data(market_data: dict) -> pd.DataFrame:
+    """
+    DataFrame date, price_usd a partir de la respuesta de market_chart: los arrays
+    de payloads.parse_market_chart (sin copiar a objetos de Python) o la lista de
+    pares [timestamp_ms, precio] del JSON.
+    """
     prices = market_data.get('prices', [])
-    df = pd.DataFrame(prices, columns=['timestamp', 'price_usd'])
-    df['date'] = pd.to_datetime(df['timestamp'], unit='ms')
-    return df[['date', 'price_usd']]
+    if not isinstance(prices, tuple):
+        prices = rows_to_arrays(prices, 2)
+    timestamps, values = prices
+    return pd.DataFrame({'date': timestamps.astype('datetime64[ms]'), 'price_usd': values})
+
+def refresh_prices(coin_id: str, vs_currency: str = 'usd', days: int = 365) -> dict:
+    """
+    Descarga y guarda en SQLite lo que le falte a una moneda, sin leer su historico.
+
+    Sin datos hace la descarga completa de 'days' dias (por ventanas si es un
+    rango largo); con datos reanuda ventanas de backfill pendientes y trae los
+    dias desde el ultimo registrado hasta hoy.
+
+    Retorna:
+        Diccionario con insertados y actualizados.
+    """
+    create_db()
+    counts = {"insertados": 0, "actualizados": 0}
+    last_ms = get_last_price_timestamp(coin_id)
+
+    if last_ms is None:
+        # No hay datos, descarga completa. Rangos largos van por ventanas: lo
+        # descargado se conserva aunque falle una ventana y se reanuda despues.
+        if days > BACKFILL_WINDOW_DAYS:
+            result = backfill_prices(coin_id, start=pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days),
+                                     vs_currency=vs_currency)
+            if result["errores"]:
+                raise next(iter(result["errores"].values()))
+            counts["insertados"] = result["insertados"]
+        else:
+            raw_data = fetch_market_chart(coin_id, vs_currency, days)
+            counts = save_to_db(process_price_data(raw_data), coin_id)
+        return counts
+
+    # Huecos de una descarga inicial por ventanas que no termino
+    resumed = resume_backfill(coin_id, vs_currency)
+    if resumed["ventanas"]:
+        print(f"{coin_id}: backfill reanudado, {resumed['completadas']} ventanas completadas, "
+              f"{resumed['fallidas']} pendientes")
+        counts["insertados"] += resumed["insertados"]
+
+    # Verificar si está actualizado (sin leer el historico completo)
+    last_date = from_epoch_ms(last_ms).date()
+    today = datetime.utcnow().date()
+
+    if last_date < today:
+        # Necesita actualización desde el último día registrado hasta hoy
+        days_missing = (today - last_date).days
+        print(f"Actualizando {coin_id} desde {last_date} ({days_missing} días faltantes)")
+
+        # Traer datos faltantes desde la última fecha; save_to_db solo escribe el delta
+        raw_data = fetch_market_chart(coin_id, vs_currency, days=days_missing + 1)
+        result = save_to_db(process_price_data(raw_data), coin_id)
+        print(f"{coin_id}: {result['insertados']} insertados, {result['actualizados']} actualizados")
+        counts["insertados"] += result["insertados"]
+        counts["actualizados"] += result["actualizados"]
+    return counts
+
 
-def get_historical_price_dataframe(coin_id: str, vs_currency: str = 'usd', days: int = 365) -> pd.DataFrame:
+def get_historical_price_dataframe(coin_id: str, vs_currency: str = 'usd', days: int = 365,
+                                   refresh: bool = True, start=None, end=None,
+                                   columns: list = None) -> pd.DataFrame:
+    """
+    Historico de precios de una moneda desde SQLite, descargando lo que falte.
+    start/end/columns acotan lo que se lee de la base (ver load_from_db).
+
+    Con refresh=False solo se llama a la API si la moneda no tiene datos; la
+    actualizacion diaria queda a cargo del refresco en segundo plano (scheduler.py).
+    """
     create_db()
     #df = load_from_db(coin_id)
     #if df is not None:
@@ -84,142 +568,661 @@ def get_historical_price_dataframe(coin_id: str, vs_currency: str = 'usd', days:
     #df = process_price_data(raw_data)
     #save_to_db(df, coin_id)
     #return df
-    df = load_from_db(coin_id)
+    if refresh or get_last_price_timestamp(coin_id) is None:
+        refresh_prices(coin_id, vs_currency, days)
+    return load_from_db(coin_id, start, end, columns)
 
-    if df is None or df.empty:
-        # No hay datos, descarga completa
-        raw_data = fetch_market_chart(coin_id, vs_currency, days)
-        df = process_price_data(raw_data)
-        save_to_db(df, coin_id)
-        return df
 
-    # Verificar si está actualizado
-    last_date = df['date'].max().date()
-    today = datetime.utcnow().date()
+def _map_coins(func, coins: list, max_workers: int = None, on_result=None) -> tuple:
+    # func(coin) en paralelo, cada llamada con un lugar del limite global de descargas
+    def _limited(coin):
+        with _fetch_permit():
+            return func(coin)
 
-    if last_date < today:
-        # Necesita actualización desde el último día registrado hasta hoy
-        days_missing = (today - last_date).days
-        print(f"Actualizando {coin_id} desde {last_date} ({days_missing} días faltantes)")
+    coins = list(dict.fromkeys(coins))
+    results, errors = {}, {}
+    if not coins:
+        return results, errors
 
-        # Traer datos faltantes desde la última fecha
-        raw_data = fetch_market_chart(coin_id, vs_currency, days=days_missing + 1)
-        new_df = process_price_data(raw_data)
+    workers = min(max_workers or MAX_CONCURRENT_FETCHES, len(coins))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="price-fetch") as pool:
+        futures = {pool.submit(_limited, coin): coin for coin in coins}
+        for future in as_completed(futures):
+            coin = futures[future]
+            try:
+                results[coin] = future.result()
+            except Exception as e:
+                errors[coin] = e
+            if on_result is not None:
+                on_result(coin, results.get(coin), errors.get(coin))
+
+    # Mismo orden que la lista de entrada
+    return {c: results[c] for c in coins if c in results}, errors
+
+
+def get_historical_price_dataframes(coins: list, vs_currency: str = 'usd', days: int = 365,
+                                    max_workers: int = None, refresh: bool = True,
+                                    on_result=None) -> tuple:
+    """
+    Obtiene (y actualiza en la DB) el historico de varias monedas en paralelo.
+
+    Parámetros:
+        coins: lista de IDs de criptomonedas
+        vs_currency: moneda de referencia
+        days: dias de historico para monedas sin datos
+        max_workers: hilos del pool (por defecto MAX_CONCURRENT_FETCHES)
+        refresh: si es False no se actualizan monedas que ya tienen datos
+        on_result: funcion(coin_id, df, error) llamada al terminar cada moneda
+
+    Retorna:
+        (dataframes, errores): dos diccionarios por moneda, uno con el DataFrame
+        obtenido y otro con la excepcion de las monedas que fallaron.
+    """
+    create_db()
+    return _map_coins(lambda coin: get_historical_price_dataframe(coin, vs_currency, days, refresh),
+                      coins, max_workers, on_result)
+
+
+def refresh_prices_for_coins(coins: list, vs_currency: str = 'usd', days: int = 365,
+                             max_workers: int = None, on_result=None) -> tuple:
+    """
+    refresh_prices de varias monedas en paralelo (mismo limite global de
+    descargas que get_historical_price_dataframes), sin leer los historicos.
 
-        # Filtrar solo datos nuevos
-        new_df = new_df[new_df['date'].dt.date > last_date]
+    Parámetros:
+        on_result: funcion(coin_id, conteos, error) llamada al terminar cada moneda
+
+    Retorna:
+        (conteos, errores): {coin_id: {insertados, actualizados}} y {coin_id: excepcion}.
+    """
+    create_db()
+    return _map_coins(lambda coin: refresh_prices(coin, vs_currency, days), coins, max_workers, on_result)
 
-        if not new_df.empty:
-            df = pd.concat([df, new_df]).drop_duplicates(subset=['date']).reset_index(drop=True)
-            save_to_db(df, coin_id)
 
+def record_refresh(coin_id: str, error: Exception = None):
+    """
+    Registra el resultado del ultimo refresco programado de una moneda.
+    """
+    with transaction() as conn:
+        conn.execute("""
+            INSERT INTO refresh_log (coin_id, last_refresh, status, error) VALUES (?, ?, ?, ?)
+            ON CONFLICT (coin_id) DO UPDATE SET
+                last_refresh = excluded.last_refresh, status = excluded.status, error = excluded.error
+        """, (coin_id.lower(), to_epoch_ms(pd.Timestamp.now(tz='UTC')),
+              'error' if error else 'ok', str(error) if error else None))
+
+
+def get_refresh_log() -> pd.DataFrame:
+    """
+    Ultimo refresco por moneda. Columnas: coin_id, last_refresh (datetime UTC), status, error
+    """
+    create_db()
+    df = pd.read_sql_query("SELECT * FROM refresh_log ORDER BY coin_id", get_connection())
+    df['last_refresh'] = from_epoch_ms(df['last_refresh'])
     return df
 
 
+# ======================
+# Backfill por ventanas (reanudable)
+# ======================
+
+# Ventanas fijas de 180 dias desde epoch: /market_chart/range devuelve puntos
+# diarios para rangos de mas de 90 dias y las claves del checkpoint no cambian
+# entre corridas.
+BACKFILL_WINDOW_DAYS = 180
+# Inicio del historico completo (primeros precios de CoinGecko)
+FULL_HISTORY_START = "2013-04-28"
+_DAY_MS = 24 * 60 * 60 * 1000
+# Rango minimo pedido a la API para que la respuesta sea diaria
+_DAILY_MIN_RANGE_MS = 91 * _DAY_MS
+
+
+def plan_backfill_windows(start, end=None, window_days: int = BACKFILL_WINDOW_DAYS) -> list:
+    """
+    Ventanas [inicio, fin) en epoch ms que cubren [start, end], alineadas a
+    multiplos de window_days desde epoch. La ultima puede estar abierta (fin > end).
+    """
+    window_ms = window_days * _DAY_MS
+    start_ms = to_epoch_ms(start)
+    end_ms = to_epoch_ms(end if end is not None else pd.Timestamp.now(tz='UTC'))
+    first = start_ms - start_ms % window_ms
+    return [(w, w + window_ms) for w in range(first, end_ms + 1, window_ms)]
+
+
+def get_backfill_checkpoints(coin_id: str, vs_currency: str = 'usd') -> pd.DataFrame:
+    """
+    Ventanas ya guardadas de una moneda. Columnas: window_start, window_end, rows, completed_at
+    """
+    create_db()
+    df = pd.read_sql_query(
+        "SELECT window_start, window_end, rows, completed_at FROM backfill_windows "
+        "WHERE coin_id = ? AND vs_currency = ? AND completed_at IS NOT NULL ORDER BY window_start",
+        get_connection(), params=(coin_id.lower(), vs_currency)
+    )
+    for col in ('window_start', 'window_end', 'completed_at'):
+        df[col] = from_epoch_ms(df[col])
+    return df
+
+
+def _backfill_window(coin_id: str, vs_currency: str, window: tuple, now_ms: int) -> int:
+    window_start, window_end = window
+    closed = window_end <= now_ms
+    to_ms = window_end - 1 if closed else now_ms
+    # Ventana abierta (la actual) mas corta que 91 dias: se pide desde antes para
+    # que la respuesta siga siendo diaria
+    from_ms = min(window_start, to_ms - _DAILY_MIN_RANGE_MS)
+    with _fetch_permit():
+        raw_data = fetch_market_chart_range(coin_id, from_ms, to_ms, vs_currency)
+    df = process_price_data(raw_data)
+    df = df[df['date'] >= from_epoch_ms(window_start)]
+    result = save_to_db(df, coin_id, incremental=False)
+
+    # Solo las ventanas cerradas quedan completas; la actual la sigue el refresco diario.
+    # Se registra despues del commit de los precios: si el proceso muere entre
+    # ambos, la ventana se vuelve a bajar (el upsert es idempotente).
+    if closed:
+        with transaction() as conn:
+            conn.execute("""
+                INSERT INTO backfill_windows (coin_id, vs_currency, window_start, window_end, rows, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (coin_id, vs_currency, window_start) DO UPDATE SET
+                    window_end = excluded.window_end, rows = excluded.rows, completed_at = excluded.completed_at
+            """, (coin_id, vs_currency, window_start, window_end, len(df), now_ms))
+    return result['insertados']
+
+
+def get_pending_backfill_windows(coin_id: str, vs_currency: str = 'usd') -> list:
+    """
+    Ventanas [inicio, fin) en epoch ms que un backfill anterior planeo y no pudo
+    guardar (fallaron o el proceso se corto).
+    """
+    create_db()
+    return [tuple(r) for r in get_connection().execute(
+        "SELECT window_start, window_end FROM backfill_windows "
+        "WHERE coin_id = ? AND vs_currency = ? AND completed_at IS NULL ORDER BY window_start",
+        (coin_id.lower(), vs_currency)
+    )]
+
+
+def _run_backfill_windows(coin_id: str, vs_currency: str, pending: list, now_ms: int,
+                          result: dict, max_workers: int = None, on_window=None) -> dict:
+    # Ventanas cerradas registradas como pendientes antes de bajarlas: si fallan,
+    # el siguiente refresco de la moneda las reanuda (ver resume_backfill)
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT INTO backfill_windows (coin_id, vs_currency, window_start, window_end)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (coin_id, vs_currency, window_start) DO NOTHING
+        """, [(coin_id, vs_currency, start, end) for start, end in pending if end <= now_ms])
+
+    def _record(window, inserted, error):
+        if error is None:
+            result["completadas"] += 1
+            result["insertados"] += inserted
+        else:
+            result["fallidas"] += 1
+            result["errores"][from_epoch_ms(window[0])] = error
+        if on_window is not None:
+            on_window(window, inserted, error)
+
+    if _holds_fetch_permit():
+        # Llamado desde una descarga que ya tiene lugar en el semaforo (ej.
+        # get_historical_price_dataframes): las ventanas van en este mismo hilo
+        for window in pending:
+            try:
+                _record(window, _backfill_window(coin_id, vs_currency, window, now_ms), None)
+            except Exception as e:
+                _record(window, 0, e)
+        return result
+
+    workers = min(max_workers or MAX_CONCURRENT_FETCHES, len(pending))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"backfill-{coin_id}") as pool:
+        futures = {pool.submit(_backfill_window, coin_id, vs_currency, w, now_ms): w for w in pending}
+        for future in as_completed(futures):
+            window = futures[future]
+            try:
+                _record(window, future.result(), None)
+            except Exception as e:
+                _record(window, 0, e)
+    return result
+
+
+def backfill_prices(coin_id: str, start=FULL_HISTORY_START, end=None, vs_currency: str = 'usd',
+                    window_days: int = BACKFILL_WINDOW_DAYS, max_workers: int = None,
+                    on_window=None) -> dict:
+    """
+    Descarga el historico de una moneda por ventanas (/market_chart/range), en
+    paralelo con el limite global de descargas. Cada ventana se guarda en su
+    propia transaccion al llegar y queda registrada en backfill_windows, asi
+    una corrida interrumpida (o cortada por 429) se reanuda sin volver a bajar
+    las ventanas ya guardadas.
+
+    Parámetros:
+        coin_id: ID de la criptomoneda
+        start, end: rango a cubrir (por defecto todo el historico hasta hoy)
+        vs_currency: moneda de referencia
+        window_days: dias por ventana (mas de 90 para recibir puntos diarios)
+        max_workers: ventanas en paralelo (por defecto MAX_CONCURRENT_FETCHES)
+        on_window: funcion(window, insertados, error) llamada al terminar cada ventana
+
+    Retorna:
+        Diccionario con ventanas (total), omitidas (ya guardadas), completadas,
+        fallidas, insertados y errores ({inicio de ventana: excepcion}).
+    """
+    create_db()
+    coin_id = coin_id.lower()
+    now_ms = to_epoch_ms(pd.Timestamp.now(tz='UTC'))
+    windows = plan_backfill_windows(start, end, window_days)
+    done = {r[0] for r in get_connection().execute(
+        "SELECT window_start FROM backfill_windows "
+        "WHERE coin_id = ? AND vs_currency = ? AND window_start >= ? AND completed_at IS NOT NULL",
+        (coin_id, vs_currency, windows[0][0] if windows else 0)
+    )}
+    pending = [w for w in windows if w[0] not in done]
+
+    result = {"ventanas": len(windows), "omitidas": len(windows) - len(pending),
+              "completadas": 0, "fallidas": 0, "insertados": 0, "errores": {}}
+    if not pending:
+        return result
+    return _run_backfill_windows(coin_id, vs_currency, pending, now_ms, result, max_workers, on_window)
+
+
+def resume_backfill(coin_id: str, vs_currency: str = 'usd', max_workers: int = None,
+                    on_window=None) -> dict:
+    """
+    Vuelve a bajar las ventanas pendientes de backfills anteriores de la moneda
+    (ver get_pending_backfill_windows). Retorna el mismo diccionario que backfill_prices.
+    """
+    coin_id = coin_id.lower()
+    pending = get_pending_backfill_windows(coin_id, vs_currency)
+    result = {"ventanas": len(pending), "omitidas": 0,
+              "completadas": 0, "fallidas": 0, "insertados": 0, "errores": {}}
+    if not pending:
+        return result
+    now_ms = to_epoch_ms(pd.Timestamp.now(tz='UTC'))
+    return _run_backfill_windows(coin_id, vs_currency, pending, now_ms, result, max_workers, on_window)
+
+
+# ======================
+# OHLC + volumen
+# ======================
+
+def save_ohlc_to_db(df: pd.DataFrame, coin_id: str, vs_currency: str, granularity: str) -> int:
+    """
+    Upsert de velas OHLC + volumen. Las velas ya guardadas se actualizan
+    (la ultima vela puede estar incompleta cuando se descargo).
+
+    Retorna el numero de filas escritas.
+    """
+    ts = series_to_epoch_ms(df['date'].reset_index(drop=True))
+    rows = df.reset_index(drop=True).assign(ts=ts).dropna(subset=['ts'])
+    if rows.empty:
+        return 0
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT INTO ohlc (coin_id, vs_currency, granularity, ts, open, high, low, close, volume)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (coin_id, vs_currency, granularity, ts) DO UPDATE SET
+                open = excluded.open, high = excluded.high, low = excluded.low,
+                close = excluded.close, volume = excluded.volume
+        """, zip(
+            [coin_id.lower()] * len(rows), [vs_currency.lower()] * len(rows), [granularity] * len(rows),
+            rows['ts'].astype(int).tolist(),
+            rows['open'].astype(float).tolist(), rows['high'].astype(float).tolist(),
+            rows['low'].astype(float).tolist(), rows['close'].astype(float).tolist(),
+            rows['volume'].astype(float).tolist(),
+        ))
+    return len(rows)
+
+
+def load_ohlc_from_db(coin_id: str, vs_currency: str, granularity: str, start_ms: int = None) -> pd.DataFrame:
+    """
+    Lee las velas guardadas desde start_ms (epoch ms). Columnas: date, open, high, low, close, volume
+    """
+    query = """
+        SELECT ts, open, high, low, close, volume
+        FROM ohlc
+        WHERE coin_id = ? AND vs_currency = ? AND granularity = ? AND ts >= ?
+        ORDER BY ts
+    """
+    df = pd.read_sql_query(query, get_connection(),
+                           params=(coin_id.lower(), vs_currency.lower(), granularity, start_ms or 0))
+    df.insert(0, 'date', from_epoch_ms(df.pop('ts')))
+    return df
+
+
+def get_ohlc_dataframe(coin_id: str, vs_currency: str = 'usd', days: int = 30) -> pd.DataFrame:
+    """
+    Velas OHLC + volumen de los ultimos 'days' dias servidas desde SQLite.
+
+    Solo se llama a la API si el rango no esta guardado (descarga completa) o si
+    falta la cola reciente; en ese caso se pide el menor 'days' valido con la
+    misma granularidad que cubra el hueco y se fusiona con lo guardado.
+
+    Retorna:
+        DataFrame con columnas: date, open, high, low, close, volume
+    """
+    create_db()
+    granularity = ohlc_granularity(days)
+    step_ms = OHLC_GRANULARITY_MS[granularity]
+    now_ms = to_epoch_ms(pd.Timestamp.now(tz='UTC'))
+    start_ms = now_ms - days * 86400000
+
+    first_ts, last_ts = get_connection().execute("""
+        SELECT MIN(ts), MAX(ts) FROM ohlc
+        WHERE coin_id = ? AND vs_currency = ? AND granularity = ?
+    """, (coin_id.lower(), vs_currency.lower(), granularity)).fetchone()
+
+    fetch_days = None
+    if first_ts is None or first_ts > start_ms + step_ms:
+        # Rango no cubierto: descarga completa
+        fetch_days = days
+    elif now_ms - last_ts > step_ms:
+        # Solo falta la cola: menor rango valido con la misma granularidad
+        missing_days = (now_ms - last_ts) / 86400000
+        candidates = [d for d in OHLC_VALID_DAYS
+                      if d >= missing_days and ohlc_granularity(d) == granularity]
+        fetch_days = min(candidates) if candidates else days
+
+    if fetch_days is not None:
+        print(f"Actualizando OHLC {coin_id} ({granularity}, {fetch_days} días)")
+        df_new = fetch_ohlc_with_volume(coin_id=coin_id, vs_currency=vs_currency, days=fetch_days)
+        save_ohlc_to_db(df_new, coin_id, vs_currency, granularity)
+
+    return load_ohlc_from_db(coin_id, vs_currency, granularity, start_ms)
+
+
 # ======================
 # NUEVAS FUNCIONES investment
 # ======================
 
 def insert_investment(coin_id: str, date: str, investor: str, amount: float, note: str) -> bool:
     try:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO investments (coin_id, date, investor, amount, note)
-            VALUES (?, ?, ?, ?, ?)
-        """, (coin_id, date, investor, amount, note))
-        conn.commit()
-        conn.close()
+        with transaction() as conn:
+            conn.execute("""
+                INSERT INTO investments (coin_id, date, investor, amount, note)
+                VALUES (?, ?, ?, ?, ?)
+            """, (coin_id.lower(), to_epoch_ms(date), investor, amount, note))
+        invalidate('investments', coin_id.lower())
         return True
     except sqlite3.IntegrityError:
         return False
 
+@cached('investments', ttl=INVESTMENTS_CACHE_TTL)
 def get_all_investments() -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    df = pd.read_sql_query("SELECT * FROM investments ORDER BY date DESC", conn)
-    conn.close()
+    df = pd.read_sql_query("SELECT * FROM investments ORDER BY date DESC", get_connection())
+    df['date'] = from_epoch_ms(df['date'])
     return df
-# "SELECT date, amount, note, investor  FROM investments WHERE coin_id = ?"
+# coin_id se guarda en minusculas, asi la consulta usa el indice (coin_id, date)
+@cached('investments', ttl=INVESTMENTS_CACHE_TTL, tag=_coin_tag)
 def get_investments_by_coin(coin_id: str) -> pd.DataFrame:
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    df = pd.read_sql_query("SELECT date, amount, note, investor FROM investments WHERE LOWER(coin_id) = LOWER(?)",
-        conn,
-        params=(coin_id,)
+    df = pd.read_sql_query("SELECT date, amount, note, investor FROM investments WHERE coin_id = ? ORDER BY date",
+        get_connection(),
+        params=(coin_id.lower(),)
+    )
+    df['date'] = from_epoch_ms(df['date'])
+    return df
+
+@cached('investments', ttl=INVESTMENTS_CACHE_TTL)
+def _read_investments_for_coins(coin_ids: tuple) -> pd.DataFrame:
+    placeholders = ", ".join("?" for _ in coin_ids)
+    df = pd.read_sql_query(
+        f"SELECT coin_id, date, investor, amount FROM investments WHERE coin_id IN ({placeholders}) "
+        "ORDER BY coin_id, date",
+        get_connection(),
+        params=coin_ids
     )
-    conn.close()
-    df['date'] = pd.to_datetime(df['date'])
+    df['date'] = from_epoch_ms(df['date'])
     return df
 
+
+def get_investments_for_coins(coin_ids) -> pd.DataFrame:
+    """
+    Inversiones de varias monedas en una sola consulta (usa el indice cubriente
+    (coin_id, date, investor, amount)).
+
+    Retorna:
+        DataFrame con coin_id, date (datetime), investor, amount ordenado por coin_id y date.
+    """
+    coin_ids = tuple(sorted({c.lower() for c in coin_ids}))
+    if not coin_ids:
+        return pd.DataFrame(columns=['coin_id', 'date', 'investor', 'amount'])
+    return _read_investments_for_coins(coin_ids)
+
 def delete_investment(coin_id: str, date: str, investor: str):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        DELETE FROM investments
-        WHERE coin_id = ? AND date = ? AND investor = ?
-    """, (coin_id, date, investor))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            DELETE FROM investments
+            WHERE coin_id = ? AND date = ? AND investor = ?
+        """, (coin_id.lower(), to_epoch_ms(date), investor))
+    invalidate('investments', coin_id.lower())
+
 
 
-def process_price_data_from_db(coin_id: str) -> pd.DataFrame:
+def delete_investments(keys) -> int:
+    """
+    Elimina varias inversiones en una sola transaccion (un executemany).
+
+    Parámetros:
+        keys: iterable de tuplas (coin_id, date, investor) o DataFrame con esas columnas
+
+    Retorna:
+        Numero de filas realmente eliminadas.
+    """
+    if isinstance(keys, pd.DataFrame):
+        keys = keys[['coin_id', 'date', 'investor']].itertuples(index=False, name=None)
+    rows = [(coin_id.lower(), to_epoch_ms(date), investor) for coin_id, date, investor in keys]
+    if not rows:
+        return 0
+
+    with transaction() as conn:
+        changes_before = conn.total_changes
+        conn.executemany("""
+            DELETE FROM investments
+            WHERE coin_id = ? AND date = ? AND investor = ?
+        """, rows)
+        deleted = conn.total_changes - changes_before
+
+    for coin in {r[0] for r in rows}:
+        invalidate('investments', coin)
+    return deleted
+
+@cached('prices', ttl=PRICES_CACHE_TTL, tag=_coin_tag)
+def process_price_data_from_db(coin_id: str, start=None, end=None, columns: list = None) -> pd.DataFrame:
     """
     Carga y procesa los precios históricos de una criptomoneda directamente desde SQLite.
 
     Parámetros:
         coin_id (str): ID de la criptomoneda (ej. 'bitcoin')
+        start, end: limites de fecha inclusivos (opcionales)
+        columns: subconjunto de ['date', 'price_usd'] (por defecto ambas)
 
     Retorna:
         pd.DataFrame con columnas: date (datetime), price_usd (float)
     """
-    conn = sqlite3.connect(DB_PATH)
-
-    query = """
-        SELECT date, price_usd
-        FROM prices
-        WHERE coin_id = ?
-        ORDER BY date ASC
-    """
-    df = pd.read_sql_query(query, conn, params=(coin_id,))
-    conn.close()
+    df = _read_prices(coin_id, start, end, columns)
 
     if df.empty:
         raise ValueError(f"No hay datos de precios para {coin_id} en la base de datos.")
 
-    # Convertir date a datetime
-    df['date'] = pd.to_datetime(df['date'])
-
     return df
 
 
-def bulk_insert_investments(df: pd.DataFrame) -> dict:
+def compute_positions(df_invest: pd.DataFrame = None) -> tuple:
     """
-    Inserta múltiples registros en la tabla investments desde un DataFrame.
+    Calcula en una sola pasada vectorizada la ganancia actual de cada inversion.
+
+    No se lee el historico: el precio de compra es el ultimo precio en o antes de
+    la fecha de inversion (join as-of resuelto con el indice de prices) y el
+    precio actual sale de latest_price.
+
+    Parámetros:
+        df_invest: DataFrame con coin_id, date, amount (por defecto todas las inversiones)
 
-    Retorna un diccionario con el número de registros insertados y errores.
+    Retorna:
+        (df_result, totales, errores):
+        - df_result: coin_id, fecha_inversion, monto_invertido, precio_compra,
+          precio_actual, unidades, valor_actual, ganancia, roi (mismo orden que df_invest)
+        - totales: diccionario con monto_total, valor_total, ganancia_total, roi_total
+        - errores: DataFrame con coin_id, fecha_inversion, error de las filas sin precio
     """
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    if df_invest is None:
+        df_invest = get_all_investments()
 
-    insertados = 0
-    errores = 0
+    inv = pd.DataFrame({
+        'coin_id': df_invest['coin_id'].astype(str).str.lower().to_numpy(),
+        'fecha': pd.to_datetime(df_invest['date']).to_numpy(),
+        'date': series_to_epoch_ms(df_invest['date']).to_numpy(),
+        'monto_invertido': df_invest['amount'].astype(float).to_numpy(),
+    })
+    inv['orden'] = range(len(inv))
+    inv = inv.dropna(subset=['date'])
+    inv['date'] = inv['date'].astype('int64')
 
-    for _, row in df.iterrows():
-        try:
-            cursor.execute("""
-                INSERT INTO investments (coin_id, date, investor, amount, note)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                row['coin_id'],
-                row['date'],
-                row['investor'],
-                float(row['amount']),
-                row.get('note', '')
-            ))
-            insertados += 1
-        except sqlite3.IntegrityError:
-            errores += 1
-            continue
-
-    conn.commit()
-    conn.close()
-    return {"insertados": insertados, "errores": errores}
+    latest = latest_price(inv['coin_id'].unique().tolist()).set_index('coin_id')['price_usd']
+
+    merged = inv.copy()
+    merged['precio_compra'] = asof_prices(merged['coin_id'], merged['date'])
+    merged['precio_actual'] = merged['coin_id'].map(latest)
+
+    missing = merged['precio_compra'].isna()
+    errores = pd.DataFrame({
+        'coin_id': merged.loc[missing, 'coin_id'],
+        'fecha_inversion': merged.loc[missing, 'fecha'].dt.date,
+        'error': merged.loc[missing, 'precio_actual'].isna().map({
+            True: "No hay datos de precios en la base de datos",
+            False: "No hay precio anterior a la fecha de inversión",
+        }),
+    }).reset_index(drop=True)
+
+    ok = merged[~missing]
+    unidades = ok['monto_invertido'] / ok['precio_compra']
+    valor_actual = unidades * ok['precio_actual']
+    ganancia = valor_actual - ok['monto_invertido']
+    df_result = pd.DataFrame({
+        'coin_id': ok['coin_id'],
+        'fecha_inversion': ok['fecha'].dt.date,
+        'monto_invertido': ok['monto_invertido'],
+        'precio_compra': ok['precio_compra'],
+        'precio_actual': ok['precio_actual'],
+        'unidades': unidades,
+        'valor_actual': valor_actual,
+        'ganancia': ganancia,
+        'roi': ganancia / ok['monto_invertido'],
+    }).reset_index(drop=True)
+
+    monto_total = float(df_result['monto_invertido'].sum())
+    ganancia_total = float(df_result['ganancia'].sum())
+    totales = {
+        'monto_total': monto_total,
+        'valor_total': float(df_result['valor_actual'].sum()),
+        'ganancia_total': ganancia_total,
+        'roi_total': ganancia_total / monto_total if monto_total else 0.0,
+    }
+    return df_result, totales, errores
+
+
+INVESTMENT_COLUMNS = ['coin_id', 'date', 'investor', 'amount', 'note']
+
+
+def _normalize_investments(df: pd.DataFrame) -> tuple:
+    """
+    Valida y normaliza (vectorizado) un bloque de inversiones.
+
+    Retorna:
+        (validas, rechazadas): validas con coin_id en minusculas, date en epoch ms
+        y amount float; rechazadas son las filas originales con la columna 'error'.
+    """
+    n = len(df)
+    note = df['note'] if 'note' in df.columns else pd.Series([''] * n, index=df.index)
+    normalized = pd.DataFrame({
+        'coin_id': df['coin_id'].astype('string').str.strip().str.lower(),
+        'date': series_to_epoch_ms(df['date']).set_axis(df.index),
+        'investor': df['investor'].astype('string').str.strip(),
+        'amount': pd.to_numeric(df['amount'], errors='coerce'),
+        'note': note.astype('string').fillna(''),
+    }, index=df.index)
+
+    error = pd.Series(pd.NA, index=df.index, dtype='string')
+    checks = [
+        (normalized['coin_id'].isna() | (normalized['coin_id'] == ''), "coin_id vacío"),
+        (normalized['date'].isna(), "fecha inválida"),
+        (normalized['investor'].isna() | (normalized['investor'] == ''), "inversionista vacío"),
+        (normalized['amount'].isna() | (normalized['amount'] < 0), "monto inválido"),
+    ]
+    # Se conserva el primer motivo de rechazo de cada fila
+    for mask, reason in reversed(checks):
+        error = error.mask(mask.fillna(True), reason)
+
+    invalid = error.notna()
+    rejected = df[invalid].assign(error=error[invalid])
+    return normalized[~invalid], rejected
+
+
+def bulk_insert_investments(data, chunksize: int = 50_000) -> dict:
+    """
+    Carga masiva de inversiones en una sola transaccion.
+
+    Cada bloque se valida de forma vectorizada, se copia a una tabla temporal con
+    un executemany y al final se fusiona con INSERT OR IGNORE (las claves
+    repetidas, en la base o en el mismo archivo, cuentan como duplicadas).
+
+    Parámetros:
+        data: DataFrame o iterable de DataFrames (ej. pd.read_csv(..., chunksize=N)),
+            con columnas coin_id, date, investor, amount y opcionalmente note
+        chunksize: tamaño de bloque al recorrer un DataFrame grande
+
+    Retorna:
+        Diccionario con insertados, duplicados, invalidos y rechazados
+        (DataFrame con las filas invalidas y el motivo en 'error').
+    """
+    if isinstance(data, pd.DataFrame):
+        chunks = (data.iloc[i:i + chunksize] for i in range(0, len(data), chunksize))
+    else:
+        chunks = data
+
+    validos = 0
+    rechazados = []
+
+    with transaction() as conn:
+        conn.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS investments_staging (
+                coin_id TEXT, date INTEGER, investor TEXT, amount REAL, note TEXT
+            )
+        """)
+        conn.execute("DELETE FROM investments_staging")
+
+        for chunk in chunks:
+            valid, rejected = _normalize_investments(chunk)
+            if not rejected.empty:
+                rechazados.append(rejected)
+            if valid.empty:
+                continue
+            conn.executemany(
+                "INSERT INTO investments_staging (coin_id, date, investor, amount, note) VALUES (?, ?, ?, ?, ?)",
+                zip(valid['coin_id'].tolist(), valid['date'].astype('int64').tolist(),
+                    valid['investor'].tolist(), valid['amount'].astype(float).tolist(),
+                    valid['note'].tolist())
+            )
+            validos += len(valid)
+
+        changes_before = conn.total_changes
+        conn.execute("""
+            INSERT OR IGNORE INTO investments (coin_id, date, investor, amount, note)
+            SELECT coin_id, date, investor, amount, note FROM investments_staging ORDER BY rowid
+        """)
+        insertados = conn.total_changes - changes_before
+        coins = [r[0] for r in conn.execute("SELECT DISTINCT coin_id FROM investments_staging")]
+        conn.execute("DELETE FROM investments_staging")
+
+    if insertados:
+        for coin in coins:
+            invalidate('investments', coin)
+
+    rechazados = pd.concat(rechazados) if rechazados else pd.DataFrame(columns=INVESTMENT_COLUMNS + ['error'])
+    return {
+        "insertados": insertados,
+        "duplicados": validos - insertados,
+        "invalidos": len(rechazados),
+        "rechazados": rechazados,
+    }
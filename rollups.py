@@ -0,0 +1,91 @@
+# Agregados de precios por granularidad (diario / semanal) a partir de prices
+
+# prices guarda los puntos tal como llegan de la API (5 min, por hora o
+# diarios segun el rango pedido). Los agregados tienen una fila por moneda e
+# intervalo con open/high/low/close, asi los lectores ven una densidad pareja:
+#
+#   prices_daily   -> intervalos de 1 dia (UTC)
+#   prices_weekly  -> semanas de lunes a domingo (UTC)
+#
+# Se recalculan solo los intervalos desde la primera fecha escrita (ver
+# processing.save_to_db), dentro de la misma transaccion que los precios.
+
+import sqlite3
+
+DAY_MS = 24 * 60 * 60 * 1000
+WEEK_MS = 7 * DAY_MS
+# 1970-01-01 fue jueves: las semanas se alinean al lunes 1970-01-05
+_WEEK_OFFSET_MS = 4 * DAY_MS
+
+# granularidad -> (tabla, tamaño del intervalo en ms, desfase del inicio)
+ROLLUPS = {
+    '1d': ('prices_daily', DAY_MS, 0),
+    '1w': ('prices_weekly', WEEK_MS, _WEEK_OFFSET_MS),
+}
+
+
+def bucket_start(ms: int, granularity: str) -> int:
+    """
+    Inicio (epoch ms) del intervalo de la granularidad que contiene ms.
+    """
+    _, size, offset = ROLLUPS[granularity]
+    return ms - (ms - offset) % size
+
+
+def create_rollup_tables(conn: sqlite3.Connection):
+    for table, _, _ in ROLLUPS.values():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                coin_id TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                samples INTEGER NOT NULL,
+                last_ts INTEGER NOT NULL,
+                PRIMARY KEY (coin_id, bucket)
+            ) WITHOUT ROWID
+        """)
+
+
+def refresh_rollups(conn: sqlite3.Connection, coin_id: str = None, since_ms: int = None) -> int:
+    """
+    Recalcula los agregados de una moneda (o de todas) desde el intervalo que
+    contiene since_ms. open/close se leen por PK con la primera y ultima fecha
+    de cada intervalo.
+
+    Retorna:
+        Filas escritas en todas las tablas de agregados.
+    """
+    changes_before = conn.total_changes
+    for granularity, (table, size, offset) in ROLLUPS.items():
+        conditions, params = [], [offset, size]
+        if coin_id is not None:
+            conditions.append("coin_id = ?")
+            params.append(coin_id)
+        if since_ms is not None:
+            conditions.append("date >= ?")
+            params.append(bucket_start(since_ms, granularity))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # WHERE true: requerido por SQLite para un upsert sobre un SELECT con JOIN
+        conn.execute(f"""
+            WITH g AS (
+                SELECT coin_id, date - (date - ?) % ? AS bucket,
+                       MIN(date) AS first_ts, MAX(date) AS last_ts,
+                       MAX(price_usd) AS high, MIN(price_usd) AS low, COUNT(*) AS samples
+                FROM prices
+                {where}
+                GROUP BY coin_id, bucket
+            )
+            INSERT INTO {table} (coin_id, bucket, open, high, low, close, samples, last_ts)
+            SELECT g.coin_id, g.bucket, o.price_usd, g.high, g.low, c.price_usd, g.samples, g.last_ts
+            FROM g
+            JOIN prices o ON o.coin_id = g.coin_id AND o.date = g.first_ts
+            JOIN prices c ON c.coin_id = g.coin_id AND c.date = g.last_ts
+            WHERE true
+            ON CONFLICT (coin_id, bucket) DO UPDATE SET
+                open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close,
+                samples = excluded.samples, last_ts = excluded.last_ts
+        """, params)
+    return conn.total_changes - changes_before
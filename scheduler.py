@@ -0,0 +1,99 @@
+# Refresco de precios en segundo plano (fuera del request de Streamlit)
+
+# Uso:
+#   - Dentro de la app: start_price_refresher() una vez por proceso (st.cache_resource)
+#   - Como worker separado:  python scheduler.py [--interval 900] [--coins bitcoin solana]
+
+import argparse
+import random
+import threading
+import time
+
+from processing import AVAILABLE_COINS, record_refresh, refresh_prices_for_coins
+
+REFRESH_INTERVAL_S = 15 * 60
+REFRESH_JITTER_S = 60
+
+
+class PriceRefresher(threading.Thread):
+    """
+    Hilo daemon que mantiene al dia el historico de la watchlist en SQLite.
+
+    En cada ciclo actualiza todas las monedas (en paralelo, con el limite global
+    de descargas) y registra el resultado en refresh_log. Entre ciclos espera
+    'interval' segundos mas un jitter aleatorio para no sincronizar varios
+    procesos contra la API.
+
+    Parámetros:
+    - coins: monedas a mantener (por defecto AVAILABLE_COINS)
+    - interval: segundos entre ciclos
+    - jitter: segundos aleatorios maximos agregados a cada espera
+    """
+
+    def __init__(self, coins: list = None, interval: float = REFRESH_INTERVAL_S,
+                 jitter: float = REFRESH_JITTER_S, vs_currency: str = 'usd', days: int = 365):
+        super().__init__(name="price-refresher", daemon=True)
+        self.coins = list(coins or AVAILABLE_COINS)
+        self.interval = interval
+        self.jitter = jitter
+        self.vs_currency = vs_currency
+        self.days = days
+        self._stop_event = threading.Event()
+
+    def refresh_once(self) -> dict:
+        """
+        Actualiza todas las monedas una vez. Retorna {coin_id: excepcion} de las que fallaron.
+        """
+        def _record(coin, counts, error):
+            if error is not None:
+                print(f"[scheduler] Error al refrescar {coin}: {error}")
+            record_refresh(coin, error)
+
+        # Solo escribe en SQLite: el historico no se lee (las paginas lo leen al graficar)
+        _, errors = refresh_prices_for_coins(self.coins, self.vs_currency, self.days, on_result=_record)
+        return errors
+
+    def run(self):
+        # Pequeño retraso inicial para no competir con el primer render de la app
+        self._stop_event.wait(random.uniform(0, self.jitter))
+        while not self._stop_event.is_set():
+            try:
+                self.refresh_once()
+            except Exception as e:
+                print(f"[scheduler] Ciclo de refresco fallido: {e}")
+            self._stop_event.wait(self.interval + random.uniform(0, self.jitter))
+
+    def stop(self):
+        self._stop_event.set()
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start_price_refresher(**kwargs) -> PriceRefresher:
+    """
+    Arranca (una sola vez por proceso) el refresco en segundo plano y lo retorna.
+    """
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = PriceRefresher(**kwargs)
+            _refresher.start()
+    return _refresher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CryptoAI - worker de refresco de precios")
+    parser.add_argument("--coins", nargs="+", default=AVAILABLE_COINS)
+    parser.add_argument("--interval", type=float, default=REFRESH_INTERVAL_S, help="segundos entre ciclos")
+    parser.add_argument("--jitter", type=float, default=REFRESH_JITTER_S)
+    args = parser.parse_args()
+
+    refresher = PriceRefresher(args.coins, args.interval, args.jitter)
+    refresher.start()
+    try:
+        while refresher.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        refresher.stop()